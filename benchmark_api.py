@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import importados
+import inventory_api
+
+# Load test of the inventory API: many clients selling at once over keep-alive connections, against a scratch inventory.
+# Part of the sales fight over the few units of one size, to check that no unit is ever sold twice.
+# Run with: python benchmark_api.py
+CLIENTS = 32
+SECONDS = 5.0
+PRODUCTS = 500
+SIZES = ['7', '8', '9', '10']
+UNITS_PER_SIZE = 10
+CONTESTED = ('SJ00000', '9')
+CONTESTED_UNITS = 25
+CONTESTED_SHARE = 0.1
+
+
+# Function to write products.csv and available.csv with every size of every product in stock
+def write_fake_inventory():
+    ids = [f"SJ{number:05d}" for number in range(PRODUCTS)]
+    available = pd.DataFrame({
+        'ID': np.repeat(ids, len(SIZES)),
+        'Type': 'S',
+        'Gender': 'J',
+        'Brand': 'Nike',
+        'Name': [f"Zapas {product_id}" for product_id in np.repeat(ids, len(SIZES))],
+        'Color': 'Black',
+        'Cost (USD)': 60.0,
+        'Expected Price (USD)': 200.0,
+        'Trip #': 1,
+        'Sizes': SIZES * PRODUCTS,
+        'Count': UNITS_PER_SIZE,
+    })
+    available.loc[(available['ID'] == CONTESTED[0]) & (available['Sizes'] == CONTESTED[1]), 'Count'] = CONTESTED_UNITS
+    available.to_csv(importados.AVAILABLE_FILE, index=False)
+    products = available.drop(columns=['Sizes', 'Count']).drop_duplicates('ID').join(importados.summarize_sizes(available), on='ID')
+    products[importados.PRODUCT_COLUMNS].to_csv(importados.PRODUCTS_FILE, index=False)
+    pd.DataFrame(columns=importados.SOLD_COLUMNS).to_csv(importados.SOLD_FILE, index=False)
+    return available
+
+
+# Sell over one connection until the deadline, recording the status and latency of every request
+async def client(port, keys, deadline, results):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    while time.perf_counter() < deadline:
+        product_id, size = CONTESTED if random.random() < CONTESTED_SHARE else random.choice(keys)
+        body = json.dumps({'id': product_id, 'size': size, 'price': 180}).encode('utf-8')
+        start = time.perf_counter()
+        writer.write(f"POST /sales HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()).strip():
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        await reader.readexactly(length)
+        results.append((status, time.perf_counter() - start))
+    writer.close()
+
+
+async def load_test(store, keys):
+    service, server = await inventory_api.start_api(store, importados.update_product, port=0)
+    port = server.sockets[0].getsockname()[1]
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, keys, start + SECONDS, results) for _ in range(CLIENTS)))
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+    await service.stop()
+    return results, elapsed
+
+
+# Function to check the inventory on disk against what the clients were told
+def check_inventory(backend, available, sold_count):
+    store = importados.open_store(backend)
+    sold = store.sold
+    sold_per_size = sold.groupby(['ID', 'Size Sold']).size()
+    stock = available.set_index(['ID', 'Sizes'])['Count']
+    oversold = (sold_per_size > stock.reindex(sold_per_size.index)).sum()
+    contested = int(sold_per_size.get(CONTESTED, 0))
+    remaining = int(pd.to_numeric(store.available['Count']).sum())
+    problems = []
+    if len(sold) != sold_count:
+        problems.append(f"{len(sold)} sales on disk, {sold_count} confirmed")
+    if oversold:
+        problems.append(f"{oversold} sizes oversold")
+    if contested != CONTESTED_UNITS:
+        problems.append(f"{contested} of the {CONTESTED_UNITS} contested units sold")
+    if remaining != int(stock.sum()) - sold_count:
+        problems.append(f"{remaining} units left instead of {int(stock.sum()) - sold_count}")
+    return problems
+
+
+if __name__ == "__main__":
+    print(f"{CLIENTS} clients for {SECONDS:.0f}s, {PRODUCTS * len(SIZES)} sizes, {CONTESTED_SHARE:.0%} of the sales on one size of {CONTESTED_UNITS} units")
+    print(f"{'backend':<8} {'sales':>7} {'sold out':>9} {'sales/s':>8} {'p50':>8} {'p99':>8}  check")
+    root = os.getcwd()
+    for backend in ['csv', 'sqlite']:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                available = write_fake_inventory()
+                keys = list(zip(available['ID'], available['Sizes']))
+                results, elapsed = asyncio.run(load_test(importados.open_store(backend), keys))
+
+                statuses = np.array([status for status, _ in results])
+                latencies = np.array([latency for _, latency in results]) * 1000
+                sold_count = int((statuses == 201).sum())
+                problems = check_inventory(backend, available, sold_count)
+                print(f"{backend:<8} {sold_count:>7} {int((statuses == 409).sum()):>9} {sold_count / elapsed:>8.0f} "
+                      f"{np.percentile(latencies, 50):>6.1f}ms {np.percentile(latencies, 99):>6.1f}ms  {'; '.join(problems) or 'ok'}")
+            finally:
+                os.chdir(root)
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import site_builder
+
+# Benchmark of the catalogue and view grouping: the old iterrows loops against the groupby versions
+# Run with: python benchmark_grouping.py
+SIZES = ['5.5', '6', '6.5', '7', '9', '9.5', '10', '11', 'S', 'M', 'L', 'NS']
+
+
+# Function to make a fake available.csv with about three sizes per product
+def fake_available(rows):
+    rng = np.random.default_rng(0)
+    ids = pd.Series(rng.integers(0, rows // 3, rows)).map(lambda number: f"SJ{number:05d}")
+    return pd.DataFrame({
+        'ID': ids,
+        'Type': rng.choice(site_builder.TYPE_ORDER, rows),
+        'Gender': 'J',
+        'Brand': 'Nike',
+        'Name': 'Zapas ' + ids,
+        'Color': 'Black',
+        'Cost (USD)': 60.0,
+        'Expected Price (USD)': 200.0,
+        'Trip #': 1,
+        'Sizes': rng.choice(SIZES, rows),
+        'Count': 1,
+    })
+
+
+# The catalogue grouping as it was written with iterrows
+def iterrows_model(df):
+    unique_products = {}
+    df = df.copy()
+    df['Type'] = pd.Categorical(df['Type'], categories=site_builder.TYPE_ORDER, ordered=True)
+    df = df.sort_values('Type')
+
+    for _, row in df.iterrows():
+        product_id = row['ID']
+        if product_id not in unique_products:
+            unique_products[product_id] = {
+                'Type': row['Type'],
+                'Brand': row['Brand'],
+                'Name': row['Name'],
+                'Color': row['Color'],
+                'Expected Price (USD)': row['Expected Price (USD)'],
+                'Sizes': [row['Sizes']],
+                'Image': f"images/{product_id}.png"
+            }
+        elif row['Sizes'] not in unique_products[product_id]['Sizes']:
+            unique_products[product_id]['Sizes'].append(row['Sizes'])
+    return unique_products
+
+
+# The available-products view as it was written: every row copied into a list and back into a DataFrame
+def iterrows_view(df):
+    df = df.copy()
+    df['Sizes'] = df['Sizes'].astype(str)
+    available_products = []
+    for _, row in df.iterrows():
+        available_products.append({column: row[column] for column in df.columns})
+    return pd.DataFrame(available_products)
+
+
+# The same view grouped per product
+def groupby_view(df):
+    products = site_builder.group_products(df)
+    products['Sizes'] = products['Sizes'].str.join(', ')
+    return products
+
+
+def best_time(function, df, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(df)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    benchmarks = [
+        ('catalogue', iterrows_model, site_builder.build_catalogue_model),
+        ('view', iterrows_view, groupby_view),
+    ]
+    print(f"{'path':<10} {'rows':>8} {'iterrows':>10} {'groupby':>10} {'speedup':>8}")
+    for rows in [10_000, 100_000]:
+        df = fake_available(rows)
+        for name, old_function, new_function in benchmarks:
+            old = best_time(old_function, df, repeat=1)
+            new = best_time(new_function, df, repeat=3)
+            print(f"{name:<10} {rows:>8} {old:>9.3f}s {new:>9.3f}s {old / new:>7.1f}x")
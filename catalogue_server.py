@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import site_builder
+
+# Fingerprinted files never change under the same name, so browsers may keep them for a year without asking again.
+# Pages, indexes and the other images are checked on every use, and the answer is a 304 when nothing changed
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'
+IMMUTABLE_DIRS = [site_builder.ASSET_DIR, site_builder.VARIANT_DIR.replace(os.sep, '/')]
+
+# Types worth compressing, the images already are
+COMPRESSED_TYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript', 'application/json', 'image/svg+xml'}
+
+# Files of the working directory that may be served besides the rendered pages. The inventory files never are
+STATIC_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.ico', '.svg', '.css', '.js', '.ttf', '.woff', '.woff2'}
+
+
+# Class for one response body, compressed once, with strong ETags made from its contents
+class Resource:
+    def __init__(self, body, content_type, cache_control=REVALIDATE_CACHE):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+        # Each encoding is a different representation, so it gets its own tag
+        self.gzipped = None
+        self.gzip_etag = self.etag[:-1] + '-gzip"'
+        if content_type.split(';')[0] in COMPRESSED_TYPES:
+            gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gzipped) < len(body):
+                self.gzipped = gzipped
+
+
+# Function to tell whether a client takes gzip, from its Accept-Encoding header
+def accepts_gzip(header):
+    for coding in (header or '').split(','):
+        name, _, parameters = coding.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            quality = parameters.replace(' ', '').lower()
+            if not quality.startswith('q='):
+                return True
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+# Function to check an If-None-Match header against the tag of the representation about to be sent
+def etag_matches(header, etag):
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    # A weak comparison, as RFC 9110 asks for If-None-Match
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+# Class to keep every page of the catalogue rendered in memory, with the JSON and search indexes and the static files
+class CatalogueSite:
+    def __init__(self, variants=site_builder.CATALOGUE_VARIANTS):
+        self.variants = variants
+        self.cache = site_builder.FragmentCache()
+        self.assets = site_builder.build_assets()
+        self.keys = {}  # Page -> hash of what it shows
+        self.pages = {}  # Page -> Resource
+        self.indexes = {}  # JSON and search index -> Resource
+        self.static = {}  # Path -> ((mtime, size), Resource)
+        self.lock = threading.Lock()
+
+    # Take a new product model, rendering again only the pages whose cards or links changed
+    def update(self, products, images):
+        pages, indexes = site_builder.plan_pages(products, self.variants)
+        card_keys = {page['filename']: site_builder.page_card_keys(page, images) for page in pages}
+        keys = {page['filename']: site_builder.page_key(page, card_keys[page['filename']]) for page in pages}
+
+        rendered = {}
+        for page in pages:
+            filename = page['filename']
+            if self.keys.get(filename) == keys[filename]:
+                rendered[filename] = self.pages[filename]
+                continue
+            body = ''.join(site_builder.stream_planned_page(page, self.cache, images, self.assets)).encode('utf-8')
+            rendered[filename] = Resource(body, 'text/html; charset=utf-8')
+
+        index_resources = {}
+        for index in indexes:
+            content = site_builder.product_index(index['products'], index['pages'], index['include_price'], images)
+            index_resources[site_builder.product_index_filename(index['filename'])] = Resource(content.encode('utf-8'), 'application/json')
+            # Already gzipped, the browser unpacks it itself
+            content = site_builder.search_index(index['products'], index['pages'])
+            index_resources[site_builder.search_index_filename(index['filename'])] = Resource(content, 'application/gzip')
+
+        # Later builds reuse the cards rendered by this one. Cards no page shows anymore are dropped, or a long-running
+        # server would keep every version of every card it ever rendered
+        shown = {key for page_keys in card_keys.values() for key in page_keys}
+        fragments = {**self.cache.fragments, **self.cache.used}
+        self.cache.fragments = {key: fragment for key, fragment in fragments.items() if key in shown}
+        self.cache.used = {}
+
+        changed = sum(1 for filename, key in keys.items() if self.keys.get(filename) != key)
+        removed = len(self.keys.keys() - keys.keys())
+        # Swapped whole, so a request sees either the old catalogue or the new one
+        with self.lock:
+            self.keys, self.pages, self.indexes = keys, rendered, index_resources
+        print(f"Catalogue updated: {changed} pages rendered, {len(keys) - changed} unchanged, {removed} removed.")
+
+    # Read a static file, again only when its modification time or size changed
+    def static_file(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.static.get(path)
+        if entry is None or entry[0] != (stat.st_mtime_ns, stat.st_size):
+            with open(path, 'rb') as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            immutable = any(path.startswith(directory + '/') for directory in IMMUTABLE_DIRS)
+            entry = ((stat.st_mtime_ns, stat.st_size), Resource(body, content_type, IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE))
+            self.static[path] = entry
+        return entry[1]
+
+    # Find what a URL path points to, or None
+    def resource(self, url_path):
+        path = posixpath.normpath(urllib.parse.unquote(url_path)).lstrip('/')
+        if path in ('', '.'):
+            path = 'index.html'
+        if path == '..' or path.startswith('../'):
+            return None
+
+        with self.lock:
+            resource = self.pages.get(path) or self.indexes.get(path)
+        if resource is None and os.path.splitext(path)[1].lower() in STATIC_EXTENSIONS and os.path.isfile(path):
+            resource = self.static_file(path)
+        return resource
+
+
+# Class to answer GET and HEAD requests from a CatalogueSite
+class CatalogueHandler(BaseHTTPRequestHandler):
+    site = None
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        resource = self.site.resource(urllib.parse.urlsplit(self.path).path)
+        if resource is None:
+            self.send_error(404)
+            return
+
+        gzipped = resource.gzipped is not None and accepts_gzip(self.headers.get('Accept-Encoding'))
+        etag = resource.gzip_etag if gzipped else resource.etag
+        body = resource.gzipped if gzipped else resource.body
+
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_validators(resource, etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', resource.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_validators(resource, etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_validators(self, resource, etag):
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', resource.cache_control)
+        if resource.gzipped is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+
+
+# Function to start serving a CatalogueSite in a background thread, returning the server so it can be shut down
+def start_server(site, host='127.0.0.1', port=8000):
+    handler = type('Handler', (CatalogueHandler,), {'site': site})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,16 +1,944 @@
-import pandas as pd
+import argparse
+import csv
+import datetime
+import functools
+import html
+import importlib.util
+import json
 import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+# Advisory file locks: flock where there is one, otherwise (Windows) msvcrt, which only has exclusive locks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+# Function to import a module only when one of its attributes is first used, so commands that
+# never touch pandas (or the site builder, which pulls in numpy and Pillow) start fast
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+pd = lazy_import('pandas')
+site_builder = lazy_import('site_builder')
+product_search = lazy_import('product_search')
+sales_rollup = lazy_import('sales_rollup')
+trip_summary = lazy_import('trip_summary')
+catalogue_server = lazy_import('catalogue_server')
+inventory_api = lazy_import('inventory_api')
 
 # File names
 PRODUCTS_FILE = 'products.csv'
 AVAILABLE_FILE = 'available.csv'
 SOLD_FILE = 'sold.csv'
+SALES_JOURNAL_FILE = 'sales_journal.csv'
+DATABASE_FILE = 'inventory.db'
+TRANSACTION_FILE = 'transaction.json'
+ID_COUNTERS_FILE = 'id_counters.json'
+SALES_ROLLUP_FILE = 'sales_rollup.json'
+TRIP_SUMMARY_FILE = 'trip_summary.json'
+LOCK_FILE = 'inventory.lock'
+
+# Times an operation is applied again on fresh data when another session saved first
+CONFLICT_RETRIES = 5
+
+# Columns of each file
+PRODUCT_COLUMNS = ['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes', 'Count']
+AVAILABLE_COLUMNS = ['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes', 'Count']
+
+# Columns of a sale line, in the order they are appended to the journal
+SOLD_COLUMNS = ['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes', 'Selling Date', 'Final Price', 'Customer', 'Notes', 'Count', 'Size Sold']
+
+# Columns read as text so sizes like 9 and 9.5 compare equal to what is typed
+TEXT_COLUMNS = {'ID': str, 'Sizes': str, 'Size Sold': str}
+
+
+# Function to take sold units out of the available rows
+def apply_sales(available_df, sales_df):
+    if not sales_df.empty:
+        # Count the sales for each (ID, size) and subtract them in one join
+        sold_counts = sales_df.groupby(['ID', 'Size Sold']).size().rename('Sold')
+        available_df = available_df.join(sold_counts, on=['ID', 'Sizes'])
+        available_df['Count'] = available_df['Count'] - available_df['Sold'].fillna(0)
+        available_df = available_df.drop(columns='Sold')
+
+    # Remove entries where count is zero, also the ones written that way by hand
+    return available_df[available_df['Count'] > 0].reset_index(drop=True)
+
+
+# Function to find the highest number used by each ID prefix, in one pass over the IDs
+def last_id_numbers(ids):
+    # Compare numbers, not strings, so SJ100 comes after SJ99
+    parts = ids.astype(str).str.extract(r'^(\D+)(\d+)$').dropna()
+    return parts[1].astype(int).groupby(parts[0]).max()
+
+
+# Function to number new IDs from each prefix's next free number, in order within each prefix
+def number_ids(prefixes, next_numbers):
+    numbers = prefixes.map(next_numbers).fillna(1).astype(int) + prefixes.groupby(prefixes).cumcount()
+    return prefixes + numbers.map('{:02d}'.format)
+
+
+# Function to write a file and make sure it reached the disk
+def write_synced(path, write):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Function to move staged files into place and drop the transaction log
+def finish_transaction(transaction_file, renames, remove):
+    for staged_path, path in renames:
+        if os.path.exists(staged_path):
+            os.replace(staged_path, path)
+    for path in remove:
+        if os.path.exists(path):
+            os.remove(path)
+    if os.path.exists(transaction_file):
+        os.remove(transaction_file)
+
+
+# Exception raised when another session saved changes to the files an operation read, before the operation could save its own
+class ConcurrentChange(Exception):
+    pass
+
+
+# Function to identify a version of a file. A rewrite is a new inode and an append changes the size, so a change is seen
+# even when it lands within the same modification time tick
+def file_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+# Function to hold an advisory lock on a lock file, shared by sessions reading the files or exclusive to one saving them
+@contextmanager
+def file_lock(path, exclusive=True):
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Decorator to run an operation on the store as one transaction, again on fresh data if another session saved first
+def retry_on_conflict(operation):
+    @functools.wraps(operation)
+    def retrying(store, *args, **kwargs):
+        return store.apply(lambda: operation(store, *args, **kwargs))
+    return retrying
+
+
+# Function to finish or roll back a save interrupted by a crash
+def recover_transaction(transaction_file, paths):
+    if os.path.exists(transaction_file):
+        try:
+            with open(transaction_file, encoding='utf-8') as f:
+                intent = json.load(f)
+        except ValueError:
+            intent = None  # The log itself was cut short, so nothing was renamed yet
+
+        if intent is None:
+            os.remove(transaction_file)
+        else:
+            # Every staged file was synced before the log was written, so roll forward
+            finish_transaction(transaction_file, intent['renames'], intent['remove'])
+            print("Finished saving changes interrupted in the last session.")
+
+    # Staged files without a log were never committed
+    for path in paths:
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+
+
+# Class to keep the three CSV files in memory for the whole session
+class InventoryStore:
+    def __init__(self, products_file=PRODUCTS_FILE, available_file=AVAILABLE_FILE, sold_file=SOLD_FILE, journal_file=SALES_JOURNAL_FILE):
+        self.paths = {
+            'products': products_file,
+            'available': available_file,
+            'sold': sold_file,
+        }
+        self.journal_file = journal_file
+        self.transaction_file = os.path.join(os.path.dirname(products_file), TRANSACTION_FILE)
+        self.id_counters_file = os.path.join(os.path.dirname(products_file), ID_COUNTERS_FILE)
+        self.id_counters = None
+        self.rollup_file = os.path.join(os.path.dirname(products_file), SALES_ROLLUP_FILE)
+        self.rollup = None
+        self.summary_file = os.path.join(os.path.dirname(products_file), TRIP_SUMMARY_FILE)
+        self.summary = None
+        self.frames = {}
+        self.mtimes = {}
+
+        # Version of each file when it was read, checked before saving so changes made by other sessions are not overwritten
+        self.versions = {}
+        self.journal_version = None
+        self.lock_file = os.path.join(os.path.dirname(products_file), LOCK_FILE)
+        self.lock_held = False
+
+        # Search index over the available products and the products changed since it was last brought up to date, None for all
+        self.search_index = None
+        self.search_changed = None
+
+        # Files changed inside the current transaction, None outside of one, and sales to append to the journal
+        self.staged = None
+        self.remove_on_commit = set()
+        self.pending_journal = []
+
+        with self.locked(exclusive=True):
+            recover_transaction(self.transaction_file, self.paths.values())
+        with self.locked():
+            self.load_journal()
+            for name in self.paths:
+                self.load(name)
+
+    # Hold the lock file, unless this session already does. Readers share it, a session saving has it alone, and only for
+    # as long as the files are read or written, so a long operation like building the site never keeps others waiting
+    @contextmanager
+    def locked(self, exclusive=False):
+        if self.lock_held:
+            yield
+            return
+        with file_lock(self.lock_file, exclusive):
+            self.lock_held = True
+            try:
+                yield
+            finally:
+                self.lock_held = False
+
+    # Sales appended since the last compaction, applied to the frames on load
+    def load_journal(self):
+        with self.locked():
+            self.journal_version = file_version(self.journal_file)
+            if os.path.exists(self.journal_file):
+                self.journal = pd.read_csv(self.journal_file, dtype=TEXT_COLUMNS)
+            else:
+                self.journal = pd.DataFrame(columns=SOLD_COLUMNS)
+
+    # Read one file from disk and remember its version
+    def load(self, name):
+        path = self.paths[name]
+        with self.locked():
+            version = file_version(path)
+            df = pd.read_csv(path, dtype=TEXT_COLUMNS)
+
+        # Journaled sales are not in the CSV files yet
+        if name == 'sold' and not self.journal.empty:
+            df = pd.concat([df, self.journal], ignore_index=True)
+        elif name == 'available':
+            df = apply_sales(df, self.journal)
+
+        self.frames[name] = df
+        if name == 'available':
+            self.index_changed()  # Read from disk, anything may have changed
+        self.versions[name] = version
+        self.mtimes[name] = version[2]
+
+    # Reload a file only if something outside this process changed it. Inside a transaction the operation already read the
+    # old contents, so it has to start over instead
+    def reload_if_changed(self, name):
+        path = self.paths[name]
+        journal_changed = file_version(self.journal_file) != self.journal_version
+        if (journal_changed or file_version(path) != self.versions.get(name)) and self.staged is not None:
+            raise ConcurrentChange(f"{self.journal_file if journal_changed else path} was changed by another session.")
+
+        if journal_changed:
+            # Another session journaled sales, or folded them into the CSV files. Read under one lock so the journal and
+            # the files it applies to are from the same save
+            with self.locked():
+                self.load_journal()
+                self.load('sold')
+                self.load('available')
+            self.rollup = None
+            self.summary = None
+        if file_version(path) != self.versions.get(name):
+            self.load(name)
+            if name == 'products':
+                self.id_counters = None  # Someone else edited the catalogue
+            elif name == 'sold':
+                self.rollup = None  # Someone else edited the sales
+            self.summary = None
+
+    def get(self, name):
+        self.reload_if_changed(name)
+        return self.frames[name]
+
+    def write(self, name):
+        with self.transaction():
+            self.staged.add(name)
+
+    # Group several writes so they all land on disk together or not at all
+    @contextmanager
+    def transaction(self):
+        if self.staged is not None:
+            yield self
+            return
+
+        self.staged = set()
+        self.remove_on_commit = set()
+        self.pending_journal = []
+        try:
+            yield self
+            staged, self.staged = self.staged, None
+            if staged or self.remove_on_commit or self.pending_journal:
+                self.commit_files(staged, self.remove_on_commit)
+        except BaseException:
+            # Throw away the in-memory changes and keep the files as they were
+            self.staged = None
+            self.pending_journal = []
+            self.id_counters = None
+            self.rollup = None
+            self.summary = None
+            self.load_journal()
+            for name in self.paths:
+                self.load(name)
+            raise
+
+    # Run operation() as one transaction on fresh data, and again when another session saved first. After CONFLICT_RETRIES
+    # conflicts it runs holding the lock alone, which keeps others waiting but cannot conflict
+    def apply(self, operation):
+        if self.staged is not None:
+            return operation()  # Part of a larger transaction, which is the one that starts over
+
+        for attempt in range(CONFLICT_RETRIES):
+            self.sync()
+            try:
+                with self.transaction():
+                    return operation()
+            except ConcurrentChange as change:
+                print(f"{change} Applying the change again on the new data.")
+
+        with self.locked(exclusive=True):
+            self.sync()
+            with self.transaction():
+                return operation()
+
+    # Pick up whatever other sessions saved
+    def sync(self):
+        with self.locked():
+            for name in self.paths:
+                self.reload_if_changed(name)
+
+    # Make sure no other session saved since the files were read
+    def check_versions(self):
+        for name, path in self.paths.items():
+            if file_version(path) != self.versions.get(name):
+                raise ConcurrentChange(f"{path} was changed by another session.")
+        if file_version(self.journal_file) != self.journal_version:
+            raise ConcurrentChange(f"{self.journal_file} was changed by another session.")
+
+    # Save the staged files and journaled sales while holding the lock alone, unless another session saved first
+    def commit_files(self, names, remove=()):
+        with self.locked(exclusive=True):
+            self.check_versions()
+            self.write_files(names, remove)
+            self.append_journal(remove)
+
+    # Stage each file next to its target, log the renames, then move them all into place
+    def write_files(self, names, remove=()):
+        renames = []
+        for name in names:
+            path = self.paths[name]
+            staged_path = path + '.tmp'
+            write_synced(staged_path, lambda f: self.frames[name].to_csv(f, index=False))
+            renames.append((staged_path, path))
+
+        # A single rename is atomic on its own, anything more needs the log for recovery
+        if len(renames) > 1 or remove:
+            write_synced(self.transaction_file, lambda f: json.dump({'renames': renames, 'remove': list(remove)}, f))
+        finish_transaction(self.transaction_file, renames, remove)
+
+        for name in names:
+            self.versions[name] = file_version(self.paths[name])
+            self.mtimes[name] = self.versions[name][2]
+        if 'products' in names and self.id_counters is not None:
+            self.save_id_counters()
+        if 'sold' in names and self.rollup is not None:
+            # A compaction folds the journal into sold.csv
+            self.save_rollup(0 if self.journal_file in remove else len(self.journal))
+        if self.summary is not None and (names or remove):
+            self.save_trip_summary(0 if self.journal_file in remove else len(self.journal))
+        if self.journal_file in remove:
+            self.journal_version = None
+
+    # Append the sales of the transaction to the journal with one write, unless a compaction already folded them in
+    def append_journal(self, remove=()):
+        pending, self.pending_journal = self.pending_journal, []
+        if not pending or self.journal_file in remove:
+            return
+        with open(self.journal_file, 'a', encoding='utf-8', newline='') as f:
+            pd.concat(pending, ignore_index=True).to_csv(f, header=f.tell() == 0, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_version = file_version(self.journal_file)
+
+    # Rollup of the sales, saved for sold.csv as last written plus the first journal_rows journaled sales
+    def sales_rollup(self):
+        self.reload_if_changed('sold')
+        if self.rollup is None:
+            self.rollup = self.load_rollup()
+        return self.rollup
+
+    def load_rollup(self):
+        if os.path.exists(self.rollup_file):
+            with open(self.rollup_file, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('sold_mtime') == self.mtimes['sold'] and saved['journal_rows'] <= len(self.journal):
+                rollup = sales_rollup.SalesRollup(saved['cells'])
+                rollup.add(self.journal.iloc[saved['journal_rows']:])
+                return rollup
+
+        # Missing or stale, total sold.csv once and save it, so later sessions only replay the sales journaled after now
+        self.rollup = sales_rollup.SalesRollup()
+        self.rollup.add(self.sold)
+        self.save_if_unchanged(self.save_rollup)
+        return self.rollup
+
+    def save_rollup(self, journal_rows):
+        saved = {'sold_mtime': self.mtimes['sold'], 'journal_rows': journal_rows, 'cells': self.rollup.rows()}
+        write_synced(self.rollup_file, lambda f: json.dump(saved, f))
+
+    # Per-trip expected profit, saved for the three files as last written plus the first journal_rows journaled sales
+    def trip_summary(self):
+        for name in self.paths:
+            self.reload_if_changed(name)
+        if self.summary is None:
+            self.summary = self.load_trip_summary()
+        return self.summary
+
+    def load_trip_summary(self):
+        if os.path.exists(self.summary_file):
+            with open(self.summary_file, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('mtimes') == self.mtimes and saved['journal_rows'] <= len(self.journal):
+                summary = trip_summary.TripSummary(saved['cells'])
+                summary.add(sales=self.journal.iloc[saved['journal_rows']:])
+                return summary
+
+        # Missing or stale, total the three files once and save it
+        self.summary = trip_summary.compute_trip_summary(self.products, self.available, self.sold)
+        self.save_if_unchanged(self.save_trip_summary)
+        return self.summary
+
+    def save_trip_summary(self, journal_rows):
+        saved = {'mtimes': self.mtimes, 'journal_rows': journal_rows, 'cells': self.summary.rows()}
+        write_synced(self.summary_file, lambda f: json.dump(saved, f))
+
+    # Save a total worked out from the files as they are on disk, unless this transaction already changed them or another
+    # session saved since they were read
+    def save_if_unchanged(self, save):
+        if self.lock_held or self.staged or self.pending_journal:
+            return
+        with self.locked(exclusive=True):
+            try:
+                self.check_versions()
+            except ConcurrentChange:
+                return
+            save(len(self.journal))
+
+    def replace_trip_summary(self, summary):
+        self.summary = summary
+        self.save_trip_summary(len(self.journal))
+
+    # Next number for each Type+Gender prefix, rebuilt from products.csv only when missing or stale
+    def load_id_counters(self):
+        if os.path.exists(self.id_counters_file):
+            with open(self.id_counters_file, encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('products_mtime') == self.mtimes['products']:
+                return saved['next']
+
+        next_numbers = (last_id_numbers(self.products['ID']) + 1).to_dict()
+        return {prefix: int(number) for prefix, number in next_numbers.items()}
+
+    def save_id_counters(self):
+        counters = {'products_mtime': self.mtimes['products'], 'next': self.id_counters}
+        write_synced(self.id_counters_file, lambda f: json.dump(counters, f, indent=2, sort_keys=True))
+
+    # Hand out new product IDs for a Series of prefixes like SJ or TN
+    def allocate_ids(self, prefixes):
+        self.reload_if_changed('products')
+        if self.id_counters is None:
+            self.id_counters = self.load_id_counters()
+
+        ids = number_ids(prefixes, self.id_counters)
+        for prefix, count in prefixes.value_counts().items():
+            self.id_counters[prefix] = self.id_counters.get(prefix, 1) + int(count)
+        return ids
+
+    # Replace a file's contents in memory and write it through to disk. changed lists the products whose available rows
+    # differ, so only those are searched again, None if it is not known
+    def set(self, name, df, changed=None):
+        if name == 'available':
+            self.index_changed(changed)
+        with self.transaction():
+            self.frames[name] = df.reset_index(drop=True)
+
+            # A full rewrite of sold or available already contains the journaled sales
+            if name in ('sold', 'available') and not self.journal.empty:
+                self.compact()
+            else:
+                self.write(name)
+
+    # Record a sale as one appended journal line instead of rewriting both files
+    def record_sale(self, sold_entry):
+        self.journal_sales(pd.DataFrame([sold_entry]))
+
+    # Append sales to the journal when the transaction commits, all of them with a single write and fsync
+    def journal_sales(self, entries_df):
+        entry_df = entries_df.reindex(columns=SOLD_COLUMNS)
+        rollup = self.sales_rollup()
+        summary = self.trip_summary()
+        with self.transaction():
+            self.frames['sold'] = pd.concat([self.get('sold'), entry_df], ignore_index=True)
+            self.frames['available'] = apply_sales(self.get('available'), entry_df)
+            self.index_changed(entry_df['ID'])
+            self.journal = pd.concat([self.journal, entry_df], ignore_index=True)
+            self.pending_journal.append(entry_df)
+            rollup.add(entry_df)
+            summary.add(sales=entry_df)
+
+    # Record many sales at once, writing sold.csv and available.csv once each
+    def record_sales(self, entries_df):
+        entries_df = entries_df.reindex(columns=SOLD_COLUMNS)
+        rollup = self.sales_rollup()
+        summary = self.trip_summary()
+        with self.transaction():
+            self.sold = pd.concat([self.sold, entries_df], ignore_index=True)
+            self.set('available', apply_sales(self.available, entries_df), entries_df['ID'])
+            rollup.add(entries_df)
+            summary.add(sales=entries_df)
+
+    # Fold the journal back into sold.csv and available.csv
+    def compact(self):
+        # Nothing journaled, here or by another session, so sold.csv and available.csv are already up to date
+        if self.staged is None:
+            self.sync()
+        if self.journal.empty and not self.pending_journal:
+            return
+
+        def fold_journal():
+            self.write('sold')
+            self.write('available')
+            self.remove_on_commit.add(self.journal_file)
+        self.apply(fold_journal)
+        self.journal = pd.DataFrame(columns=SOLD_COLUMNS)
+
+    # Mark products to index again at the next search, all of them when product_ids is None
+    def index_changed(self, product_ids=None):
+        if product_ids is None or self.search_changed is None:
+            self.search_changed = None
+        else:
+            self.search_changed.update(product_ids)
+
+    # Search the available products, re-indexing only the products changed since the last search
+    def search(self, query, sizes=None):
+        self.reload_if_changed('available')
+        if self.search_index is None or self.search_changed is None:
+            self.search_index = product_search.ProductSearch(self.available)
+        elif self.search_changed:
+            changed = list(self.search_changed)
+            self.search_index.update(self.available_rows(changed), changed)
+        self.search_changed = set()
+        return self.search_index.search(query, sizes)
+
+    # Rows of available.csv for some products
+    def available_rows(self, product_ids):
+        df = self.available
+        return df[df['ID'].isin(product_ids)]
+
+    # Files whose changes can change the catalogue
+    def watch_paths(self):
+        return [self.paths['products'], self.paths['available'], self.paths['sold'], self.journal_file]
+
+    # Forget what was loaded, so the next read picks up changes made by other processes, journal included
+    def refresh(self):
+        self.load_journal()
+        self.versions = {}
+
+    # Rows of available.csv for a product, optionally for a single size
+    def find_available(self, product_id, size=None):
+        df = self.available
+        mask = df['ID'] == product_id
+        if size is not None:
+            mask &= df['Sizes'] == size
+        return df[mask]
+
+    # Row of products.csv for a product, empty if there is none
+    def find_product(self, product_id):
+        df = self.products
+        return df[df['ID'] == product_id]
+
+    # Sales of a product, journaled ones included
+    def find_sales(self, product_id):
+        df = self.sold
+        return df[df['ID'] == product_id]
+
+    # Add rows to a file. A CSV file can only be written whole, so these three go through set()
+    def insert_rows(self, name, df):
+        self.set(name, pd.concat([self.get(name), df], ignore_index=True), df['ID'])
+
+    # Set columns of every row of a product
+    def update_rows(self, name, product_id, changes):
+        df = self.get(name).copy()
+        mask = df['ID'] == product_id
+        for column, value in changes.items():
+            df.loc[mask, column] = value
+        self.set(name, df, [product_id])
+
+    # Remove every row of a product
+    def delete_rows(self, name, product_id):
+        df = self.get(name)
+        self.set(name, df[df['ID'] != product_id], [product_id])
+
+    # The CSV files are the store, bringing them up to date only needs the journal folded in
+    def export_csv(self):
+        self.compact()
+
+    # The CSV files are the store, importing them is reading them again
+    import_csv = refresh
+
+    @property
+    def products(self):
+        return self.get('products')
+
+    @products.setter
+    def products(self, df):
+        self.set('products', df)
+
+    @property
+    def available(self):
+        return self.get('available')
+
+    @available.setter
+    def available(self, df):
+        self.set('available', df)
+
+    @property
+    def sold(self):
+        return self.get('sold')
+
+    @sold.setter
+    def sold(self, df):
+        self.set('sold', df)
+
+
+# SQLite column types, everything else is stored as text
+SQL_TYPES = {'Cost (USD)': 'REAL', 'Expected Price (USD)': 'REAL', 'Final Price': 'REAL', 'Count': 'INTEGER', 'Trip #': 'INTEGER'}
+
+TABLE_COLUMNS = {'products': PRODUCT_COLUMNS, 'available': AVAILABLE_COLUMNS, 'sold': SOLD_COLUMNS}
+
+# Indexes for point lookups by ID / (ID, size) and for trip and date queries
+SQL_INDEXES = [
+    ('products_id', 'products', ['ID']),
+    ('products_trip', 'products', ['Trip #']),
+    ('available_id_size', 'available', ['ID', 'Sizes']),
+    ('available_trip', 'available', ['Trip #']),
+    ('sold_id', 'sold', ['ID']),
+    ('sold_trip', 'sold', ['Trip #']),
+]
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+# Function to turn a DataFrame into plain Python rows for sqlite3, with None for missing values
+def sql_rows(df):
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+# Function to store dates as YYYY-MM-DD so they sort and compare as text
+def normalize_dates(dates):
+    parsed = pd.to_datetime(dates, errors='coerce', format='mixed')
+    return parsed.dt.strftime('%Y-%m-%d').fillna(dates)
+
+
+# Class to keep the inventory in an indexed SQLite database, with the CSV files as import/export format
+class SqliteInventoryStore(InventoryStore):
+    def __init__(self, db_file=DATABASE_FILE, products_file=PRODUCTS_FILE, available_file=AVAILABLE_FILE, sold_file=SOLD_FILE,
+                 journal_file=SALES_JOURNAL_FILE):
+        self.paths = {
+            'products': products_file,
+            'available': available_file,
+            'sold': sold_file,
+        }
+        self.journal_file = journal_file
+        new_database = not os.path.exists(db_file)
+        self.db_file = db_file
+        # Only ever used by one thread at a time, but not always the one that opened it (the inventory API has its own)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.in_transaction = False
+        self.search_index = None
+        self.search_changed = None
+        self.data_version = None
+        self.rollup = None
+        self.summary = None
+        self.create_tables()
+
+        # Fill a new database from the existing CSV files
+        if new_database:
+            self.import_csv()
+
+    def create_tables(self):
+        with self.conn:
+            for name, columns in TABLE_COLUMNS.items():
+                column_sql = ', '.join(f"{quote(column)} {SQL_TYPES.get(column, 'TEXT')}" for column in columns)
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({column_sql})")
+            for index_name, table, columns in SQL_INDEXES:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(map(quote, columns))})")
+
+    # Replace the tables with the contents of the CSV files, totalling the rollup and trip summary again
+    def import_csv(self):
+        # Sales the CSV store journaled are not in sold.csv and available.csv yet, so fold them in first
+        if os.path.exists(self.journal_file):
+            InventoryStore(*self.paths.values(), self.journal_file).compact()
+
+        with self.transaction():
+            for name, path in self.paths.items():
+                if os.path.exists(path):
+                    df = pd.read_csv(path, dtype=TEXT_COLUMNS)
+                    if name == 'available':
+                        df = df[df['Count'] > 0]  # Sold out, as the CSV store reads them too
+                    self.set(name, df)
+            self.rollup = sales_rollup.SqliteSalesRollup(self.conn)
+            self.rollup.rebuild(self.sold)
+            self.summary = trip_summary.SqliteTripSummary(self.conn)
+            self.summary.replace(trip_summary.compute_trip_summary(self.products, self.available, self.sold).rows())
+
+    # Write the tables back out as CSV files, each replacing the old one whole
+    def export_csv(self):
+        for name, path in self.paths.items():
+            write_synced(path + '.tmp', lambda f: self.get(name).to_csv(f, index=False))
+            os.replace(path + '.tmp', path)
+
+    def query(self, sql, params=()):
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def reload_if_changed(self, name):
+        pass
+
+    def watch_paths(self):
+        return [self.db_file]
+
+    # Every read is a query, so there is nothing to forget
+    def refresh(self):
+        pass
+
+    # SQLite already keeps other connections out while the transaction runs, so there is nothing to apply again
+    def apply(self, operation):
+        with self.transaction():
+            return operation()
+
+    # One SQLite transaction around the whole operation, holding the write lock from the start so what the operation reads
+    # cannot change under it
+    @contextmanager
+    def transaction(self):
+        if self.in_transaction:
+            yield self
+            return
+
+        self.in_transaction = True
+        try:
+            with self.conn:
+                self.conn.execute('BEGIN IMMEDIATE')
+                yield self
+        finally:
+            self.in_transaction = False
+
+    # Commit on exit unless an outer transaction is open
+    def atomic(self):
+        return nullcontext() if self.in_transaction else self.conn
+
+    def get(self, name):
+        return self.query(f"SELECT * FROM {name}")
+
+    # Replace a table's contents in one transaction. Only an import rewrites a whole table, edits change just their rows
+    def set(self, name, df, changed=None):
+        with self.atomic():
+            self.conn.execute(f"DELETE FROM {name}")
+            self.insert_rows(name, df)
+        if name == 'available':
+            self.index_changed(changed)
+
+    def insert_rows(self, name, df):
+        if name == 'available':
+            self.index_changed(df['ID'])
+        columns = TABLE_COLUMNS[name]
+        df = df.reindex(columns=columns)
+        if name == 'sold':
+            df['Selling Date'] = normalize_dates(df['Selling Date'])
+
+        placeholders = ', '.join('?' * len(columns))
+        with self.atomic():
+            self.conn.executemany(f"INSERT INTO {name} VALUES ({placeholders})", sql_rows(df))
+
+    # One UPDATE through the ID index
+    def update_rows(self, name, product_id, changes):
+        if not changes:
+            return
+        if name == 'available':
+            self.index_changed([product_id])
+        changes = pd.DataFrame([changes])
+        if 'Selling Date' in changes:
+            changes['Selling Date'] = normalize_dates(changes['Selling Date'])
+
+        assignments = ', '.join(f"{quote(column)} = ?" for column in changes.columns)
+        with self.atomic():
+            self.conn.execute(f'UPDATE {name} SET {assignments} WHERE "ID" = ?', (*next(sql_rows(changes)), product_id))
+
+    def delete_rows(self, name, product_id):
+        if name == 'available':
+            self.index_changed([product_id])
+        with self.atomic():
+            self.conn.execute(f'DELETE FROM {name} WHERE "ID" = ?', (product_id,))
+
+    # Insert the sale and decrement the available count in one transaction
+    def record_sale(self, sold_entry):
+        self.record_sales(pd.DataFrame([sold_entry]))
+
+    # There is no journal, every sale is already one transaction
+    def journal_sales(self, entries_df):
+        self.record_sales(entries_df)
+
+    # Insert the sales and decrement each (ID, size) once by its number of sales
+    def record_sales(self, entries_df):
+        entries_df = entries_df.reindex(columns=SOLD_COLUMNS)
+        entries_df['Selling Date'] = normalize_dates(entries_df['Selling Date'])
+        decrements = entries_df.groupby(['ID', 'Size Sold']).size()
+        rollup = self.sales_rollup()
+        summary = self.trip_summary()
+
+        with self.atomic():
+            self.conn.executemany(f"INSERT INTO sold VALUES ({', '.join('?' * len(SOLD_COLUMNS))})", sql_rows(entries_df))
+            self.conn.executemany('UPDATE available SET "Count" = "Count" - ? WHERE "ID" = ? AND "Sizes" = ?',
+                                  [(int(count), product_id, size) for (product_id, size), count in decrements.items()])
+            self.conn.executemany('DELETE FROM available WHERE "ID" = ? AND "Sizes" = ? AND "Count" <= 0',
+                                  [(product_id, size) for product_id, size in decrements.index])
+            rollup.add(entries_df)
+            summary.add(sales=entries_df)
+        self.index_changed(entries_df['ID'])
+
+    # Rollup of the sales kept as a table, filled from sold the first time on databases made before it existed
+    def sales_rollup(self):
+        if self.rollup is None:
+            self.rollup = sales_rollup.SqliteSalesRollup(self.conn)
+            counts = self.query('SELECT (SELECT COUNT(*) FROM sales_rollup) AS cells, (SELECT COUNT(*) FROM sold) AS sales')
+            if counts['cells'][0] == 0 and counts['sales'][0] > 0:
+                with self.atomic():
+                    self.rollup.rebuild(self.sold)
+        return self.rollup
+
+    # Per-trip expected profit kept as a table, totalled from the tables the first time on databases made before it existed
+    def trip_summary(self):
+        if self.summary is None:
+            self.summary = trip_summary.SqliteTripSummary(self.conn)
+            counts = self.query('SELECT (SELECT COUNT(*) FROM trip_summary) AS trips, (SELECT COUNT(*) FROM products) AS products')
+            if counts['trips'][0] == 0 and counts['products'][0] > 0:
+                with self.atomic():
+                    self.summary.replace(trip_summary.compute_trip_summary(self.products, self.available, self.sold).rows())
+        return self.summary
+
+    def replace_trip_summary(self, summary):
+        with self.atomic():
+            self.trip_summary().replace(summary.rows())
+
+    # Keep the CSV files up to date as the interchange format
+    def compact(self):
+        self.export_csv()
+
+    # Look up the last number of each prefix through the ID index
+    def allocate_ids(self, prefixes):
+        next_numbers = {}
+        for prefix in prefixes.unique():
+            ids = self.query('SELECT "ID" FROM products WHERE "ID" >= ? AND "ID" < ?', (prefix, prefix + '\uffff'))['ID']
+            next_numbers[prefix] = int(last_id_numbers(ids).get(prefix, 0)) + 1
+        return number_ids(prefixes, next_numbers)
+
+    # Writes of other connections change the data version, and then anything may have changed
+    def search(self, query, sizes=None):
+        data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self.data_version:
+            self.index_changed()
+            self.data_version = data_version
+        return super().search(query, sizes)
+
+    # Only the rows of the changed products, with the IDs passed as one JSON array
+    def available_rows(self, product_ids):
+        return self.query('SELECT * FROM available WHERE "ID" IN (SELECT value FROM json_each(?))', (json.dumps(list(product_ids)),))
+
+    def find_available(self, product_id, size=None):
+        if size is None:
+            return self.query('SELECT * FROM available WHERE "ID" = ?', (product_id,))
+        return self.query('SELECT * FROM available WHERE "ID" = ? AND "Sizes" = ?', (product_id, size))
+
+    def find_product(self, product_id):
+        return self.query('SELECT * FROM products WHERE "ID" = ?', (product_id,))
+
+    def find_sales(self, product_id):
+        return self.query('SELECT * FROM sold WHERE "ID" = ?', (product_id,))
+
+
+# Function to open the inventory with the chosen storage backend
+def open_store(backend='csv'):
+    if backend == 'sqlite':
+        return SqliteInventoryStore()
+    return InventoryStore()
+
+
+# Function to split the Sizes column into one (ID, size, count) row per size
+def size_rows(df):
+    sizes = df[['ID']].assign(Sizes=df['Sizes'].astype(str).str.split(',')).explode('Sizes')
+    sizes['Sizes'] = sizes['Sizes'].str.strip()
+    return sizes.groupby(['ID', 'Sizes'], sort=False).size().rename('Count').reset_index()
+
+
+# Function to build the available rows for products, one row per size with its count
+def expand_available(products_df):
+    details = products_df.drop(columns=['Sizes', 'Count'], errors='ignore')
+    return details.merge(size_rows(products_df), on='ID')[AVAILABLE_COLUMNS]
+
+
+# Function to collapse size rows into the products.csv Sizes string and total Count
+def summarize_sizes(rows):
+    return rows.groupby('ID', sort=False).agg(Sizes=('Sizes', ', '.join), Count=('Count', 'sum'))
+
+
+# Function to give products their distinct sizes and total count, and build their available rows
+def with_size_counts(products_df):
+    available_df = expand_available(products_df)
+    products_df = products_df.drop(columns=['Sizes', 'Count'], errors='ignore').join(summarize_sizes(available_df), on='ID')
+    return products_df[PRODUCT_COLUMNS], available_df
 
 
 # Function to add products
-def add_product():
-    df = pd.read_csv(PRODUCTS_FILE)
-
+def add_product(store):
     # Input product details
     print("\nTypes: type (S = Sneakers, T = T-Shirts, H = Hoodies, J = Jacket, O = Other)")
     product_type_input = input("Enter product type: ")
@@ -23,34 +951,22 @@ def add_product():
     cost = float(input("Enter cost (USD): "))
     expected_price = float(input("Enter expected price (USD): "))
     trip_number = input("Enter trip number: ")
-    sizes = input("Enter available sizes (comma separated): ").strip().split(",")
-
-    # Clean sizes and count occurrences
-    size_counts = {}
-    for size in sizes:
-        size = size.strip()  # Clean up size string
-        if size in size_counts:
-            size_counts[size] += 1  # Increment count if size already exists
-        else:
-            size_counts[size] = 1  # Initialize count for new size
+    sizes = input("Enter available sizes (comma separated): ").strip()
+
+    product_id = create_product(store, product_type_input, gender_input, brand, name, color, cost, expected_price, trip_number, sizes)
+    print(f"Product added with ID: {product_id}")
 
+
+# Function to add one product and its available rows, returning its new ID
+@retry_on_conflict
+def create_product(store, product_type_input, gender_input, brand, name, color, cost, expected_price, trip_number, sizes):
     # Generate product ID in the format {Type}{Gender}01 (e.g., HW01)
     type_code = product_type_input[0].upper()  # Get the first letter of the type
     gender_code = gender_input[0].upper()  # Get the first letter of the gender
     
-    # Find the next number for the ID
-    existing_ids = df[df['ID'].str.startswith(f"{type_code}{gender_code}")]['ID']
-
-    if existing_ids.empty:
-        new_number = 1  # Start numbering from 1 if none exist
-    else:
-        existing_numbers = existing_ids.str.extract(r'(\d+)$').astype(int)
-        new_number = existing_numbers.max()[0] + 1
+    # Take the next number for the prefix from the ID counters
+    product_id = store.allocate_ids(pd.Series([f"{type_code}{gender_code}"])).iloc[0]  # Generate ID like HW01
 
-    # Format the ID
-    product_id = f"{type_code}{gender_code}{new_number:02d}"  # Generate ID like HW01
-
-    # Use pd.concat to append the new product
     new_row_df = pd.DataFrame([{
         'ID': product_id,
         'Type': product_type_input,
@@ -61,49 +977,74 @@ def add_product():
         'Cost (USD)': cost,
         'Expected Price (USD)': expected_price,
         'Trip #': trip_number,
-        'Sizes': ', '.join(size_counts.keys()),  # Store sizes as a comma-separated string
-        'Count': sum(size_counts.values())  # Store total count
+        'Sizes': sizes
     }])
-    
-    df = pd.concat([df, new_row_df], ignore_index=True)
-    df.to_csv(PRODUCTS_FILE, index=False)
-    print(f"Product added with ID: {product_id}")
 
-    # Also add to available products
-    available_df = pd.DataFrame(columns=['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes', 'Count'])
-
-    for size, count in size_counts.items():
-        available_product = {
-            'ID': product_id,
-            'Type': product_type_input,
-            'Gender': gender_input,
-            'Brand': brand,
-            'Name': name,
-            'Color': color,
-            'Cost (USD)': cost,
-            'Expected Price (USD)': expected_price,
-            'Trip #': trip_number,
-            'Sizes': size,  # Store each size in a new row
-            'Count': count  # Store the count for this size
-        }
-        available_df = pd.concat([available_df, pd.DataFrame([available_product])], ignore_index=True)
-
-    # Write to available.csv
-    if os.path.exists(AVAILABLE_FILE):
-        existing_available_df = pd.read_csv(AVAILABLE_FILE)
-        available_df = pd.concat([existing_available_df, available_df], ignore_index=True)
+    # Count each size once: distinct sizes and total count for products.csv, one row per size for available.csv
+    new_row_df, available_df = with_size_counts(new_row_df)
+    summary = store.trip_summary()
+
+    with store.transaction():
+        # Append the new product
+        store.insert_rows('products', new_row_df)
+
+        # Also add to available products
+        store.insert_rows('available', available_df)
+        summary.add(products=new_row_df, available=available_df)
+    return product_id
+
+# Function to read a trip manifest from CSV or JSON
+def read_manifest(manifest_file):
+    if manifest_file.lower().endswith('.json'):
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = pd.DataFrame(json.load(f))
+        # JSON manifests may list sizes as an array
+        manifest['Sizes'] = manifest['Sizes'].map(lambda sizes: ', '.join(map(str, sizes)) if isinstance(sizes, list) else sizes)
+        return manifest
+    return pd.read_csv(manifest_file, dtype={'Sizes': str})
+
+
+# Function to add a whole trip from a manifest, writing each file once, returning whether it was imported
+@retry_on_conflict
+def import_trip_manifest(store, manifest_file, trip_number=None):
+    manifest = read_manifest(manifest_file)
+
+    required = ['Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Sizes']
+    if trip_number is None:
+        required.append('Trip #')
+    missing = [column for column in required if column not in manifest.columns]
+    if missing:
+        print(f"Manifest is missing columns: {', '.join(missing)}")
+        return False
+
+    if trip_number is not None:
+        manifest['Trip #'] = trip_number
+    manifest['Cost (USD)'] = pd.to_numeric(manifest['Cost (USD)'])
+    manifest['Expected Price (USD)'] = pd.to_numeric(manifest['Expected Price (USD)'])
+
+    # Allocate every ID in one vectorized pass
+    prefixes = manifest['Type'].astype(str).str[0].str.upper() + manifest['Gender'].astype(str).str[0].str.upper()
+    manifest['ID'] = store.allocate_ids(prefixes)
+
+    # Expand all sizes into available rows in one go
+    new_products, new_available = with_size_counts(manifest[['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes']])
+
+    summary = store.trip_summary()
+    with store.transaction():
+        store.insert_rows('products', new_products)
+        store.insert_rows('available', new_available)
+        summary.add(products=new_products, available=new_available)
+
+    print(f"Imported {len(new_products)} products ({int(new_available['Count'].sum())} items): {', '.join(new_products['ID'])}")
+    return True
 
-    available_df.to_csv(AVAILABLE_FILE, index=False)
 
 # Function to process sold items
-def process_sold_item():
-    available_df = pd.read_csv(AVAILABLE_FILE)  # Load available products from the available file
-    sold_df = pd.read_csv(SOLD_FILE)  # Load sold items from the sold file
-
+def process_sold_item(store):
     product_id = input("Enter product ID sold: ")
     
     # Find the available sizes for the product ID
-    available_sizes = available_df[available_df['ID'] == product_id]['Sizes'].values
+    available_sizes = store.find_available(product_id)['Sizes'].values
     if available_sizes.size == 0:
         print("Product ID not found.")
         return
@@ -118,12 +1059,19 @@ def process_sold_item():
     customer = input("Enter customer name: ")
     notes = input("Enter notes: ")
 
+    if sell_item(store, product_id, size, selling_date, final_price, customer, notes):
+        print("Item processed and recorded as sold.")
+
+
+# Function to record the sale of one item, returning whether it was in stock
+@retry_on_conflict
+def sell_item(store, product_id, size, selling_date, final_price, customer='', notes=''):
     # Check if the product ID and size are available
-    sold_item = available_df[(available_df['ID'] == product_id) & (available_df['Sizes'] == size)]
+    sold_item = store.find_available(product_id, size)
     
-    if sold_item.empty:
+    if sold_item.empty or sold_item['Count'].iloc[0] <= 0:
         print("Item not available in the specified size.")
-        return
+        return False
 
     # Update sold items DataFrame
     sold_entry = {
@@ -135,391 +1083,250 @@ def process_sold_item():
         'Size Sold': size  # Store the sold size
     }
 
-    # Convert sold_entry to DataFrame and concatenate
-    sold_entry_df = pd.DataFrame([sold_entry])
-    sold_df = pd.concat([sold_df, sold_entry_df], ignore_index=True)
-    sold_df.to_csv(SOLD_FILE, index=False)
-
-    # Update available items: Decrease the count for the sold size
-    available_df.loc[(available_df['ID'] == product_id) & (available_df['Sizes'] == size), 'Count'] -= 1  # Decrement the count by 1
-    
-    # Remove entries where count is zero
-    available_df = available_df[available_df['Count'] > 0]
-
-    # Save changes to available products
-    available_df.to_csv(AVAILABLE_FILE, index=False)
-    print("Item processed and recorded as sold.")
+    # Append the sale to the journal, which also decreases the count for the sold size
+    store.record_sale(sold_entry)
+    return True
+
+# Function to process a sheet of sales (ID, Size, Selling Date, Final Price, Customer, Notes) in one go
+@retry_on_conflict
+def process_sales_sheet(store, sheet_file):
+    sheet = pd.read_csv(sheet_file, dtype={'ID': str, 'Size': str})
+
+    missing = [column for column in ['ID', 'Size', 'Selling Date', 'Final Price'] if column not in sheet.columns]
+    if missing:
+        print(f"Sales sheet is missing columns: {', '.join(missing)}")
+        return sheet.iloc[0:0]
+
+    sheet = sheet.reindex(columns=['ID', 'Size', 'Selling Date', 'Final Price', 'Customer', 'Notes'])
+    sheet['ID'] = sheet['ID'].str.strip()
+    sheet['Size Sold'] = sheet['Size'].str.strip()
+    sheet['Final Price'] = pd.to_numeric(sheet['Final Price'], errors='coerce')
+
+    # Number repeated sales of the same item so only as many as are in stock go through
+    sheet['Unit'] = sheet.groupby(['ID', 'Size Sold']).cumcount() + 1
+
+    # Validate every row against the stock in one join
+    stock = store.available.rename(columns={'Sizes': 'Stock Size'})
+    merged = sheet.merge(stock, how='left', left_on=['ID', 'Size Sold'], right_on=['ID', 'Stock Size'])
+
+    reason = pd.Series('', index=merged.index)
+    reason[merged['Unit'] > merged['Count']] = 'oversold'
+    reason[merged['Count'].isna()] = 'not available'
+    reason[merged['Final Price'].isna()] = 'invalid price'
+    accepted = reason == ''
+
+    # The left join made the stock columns nullable, restore their types for the accepted rows
+    sold_entries = merged[accepted].astype(stock.dtypes.to_dict()).assign(Sizes=merged['Stock Size'])
+    if not sold_entries.empty:
+        store.record_sales(sold_entries)
+
+    # Report the rows that were left out and why
+    rejected = sheet.loc[~accepted.values, ['ID', 'Size', 'Selling Date', 'Final Price', 'Customer']].assign(Reason=reason[~accepted].values)
+    print(f"Recorded {len(sold_entries)} sales, rejected {len(rejected)}.")
+    if not rejected.empty:
+        print(rejected.to_string(index=False))
+    return rejected
 
 # Function to calculate expected profit
-def calculate_expected_profit():
-    df = pd.read_csv(PRODUCTS_FILE)
-    
-    # Ensure 'Sizes' column is treated as a string
-    df['Sizes'] = df['Sizes'].astype(str)
-
-    # Calculate the number of products based on the sizes
-    df['Number_of_Products'] = df['Sizes'].apply(lambda x: len(x.split(',')))  # Count the number of sizes available
-    df['Gross_Cost'] = df['Cost (USD)'] * df['Number_of_Products']  # Calculate gross cost
-    df['Expected_Selling_Price'] = df['Expected Price (USD)'] * df['Number_of_Products']  # Calculate expected selling price
-
-    # Group by Trip # and aggregate costs and expected prices
-    profit_summary = df.groupby('Trip #').agg(
-        Gross_Cost=('Gross_Cost', 'sum'),
-        Expected_Selling_Price=('Expected_Selling_Price', 'sum'),  # Use the updated expected selling price
-        Number_of_Products=('Number_of_Products', 'sum')  # Total number of products based on sizes
-    ).reset_index()
-
-    # Calculate Expected Profit
-    profit_summary['Expected_Profit'] = profit_summary['Expected_Selling_Price'] - profit_summary['Gross_Cost']
-    
+def calculate_expected_profit(store, verify=False):
+    summary = store.trip_summary()
+
+    # Audit the kept totals against a full recount of products, available and sold
+    if verify:
+        recomputed = trip_summary.compute_trip_summary(store.products, store.available, store.sold)
+        differences = trip_summary.summary_differences(summary, recomputed)
+        if differences.empty:
+            print("Trip summary matches a full recount.")
+        else:
+            print("Trip summary differed from a full recount and was replaced:")
+            print(differences.to_string(index=False))
+            store.replace_trip_summary(recomputed)
+            summary = recomputed
+
     # Print the summary
-    print(profit_summary)
+    profit_summary = summary.frame()
+    print(profit_summary.to_string(index=False))
+    return profit_summary
 
 # Function to calculate net profit based on sales period
-def calculate_net_profit(start_date, end_date):
-    sold_df = pd.read_csv(SOLD_FILE)
-    sold_df['Selling Date'] = pd.to_datetime(sold_df['Selling Date'])
-
-    filtered_sales = sold_df[(sold_df['Selling Date'] >= start_date) & (sold_df['Selling Date'] <= end_date)]
-    
-    total_cost = sum(filtered_sales['Cost (USD)'])
-    total_revenue = sum(filtered_sales['Final Price'])
-    net_profit = total_revenue - total_cost
-    number_of_products = len(filtered_sales)
+def calculate_net_profit(store, start_date, end_date, by=()):
+    # Answered from the sales rollup instead of rereading every sale
+    summary = store.sales_rollup().summary(start_date, end_date, by)
+    net_profit = round(summary['Margin'].sum(), 2)
+    number_of_products = int(summary['Units'].sum())
 
     print(f"Net Profit: {net_profit}, Number of Products Sold: {number_of_products}")
+    if by and not summary.empty:
+        print(summary.to_string(index=False))
+    return summary
+
+def create_html_files(df, variants=None):
+    # Group the products once, then write every page from that model
+    products = site_builder.build_catalogue_model(df)
+    return site_builder.render_variants(products, variants or site_builder.CATALOGUE_VARIANTS)
+
+# Function to take the modification time and size of the watched files and the top-level images
+def watch_snapshot(paths, image_dir='images'):
+    snapshot = {}
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+
+    # Only the sources, images/variants is written by the build itself
+    if os.path.isdir(image_dir):
+        for entry in os.scandir(image_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+# Function to rebuild the site whenever the inventory, the exchange rates or the images change, until interrupted with Ctrl+C.
+# Changes are collected until nothing has changed for quiet_period seconds, then only the affected steps run
+def watch_site(store, variants=None, interval=1.0, quiet_period=2.0, image_dir='images'):
+    variants = variants or site_builder.CATALOGUE_VARIANTS
+    paths = store.watch_paths() + [site_builder.EXCHANGE_RATES_FILE]
+
+    # Start from a full (incremental) build
+    products = site_builder.build_catalogue_model(store.available)
+    images = site_builder.optimize_images(site_builder.image_sources(products))
+    site_builder.render_variants(products, variants, images)
+
+    snapshot = watch_snapshot(paths, image_dir)
+    changed = set()
+    last_change = None
+    print(f"Watching {', '.join(paths)} and {image_dir}/ for changes (Ctrl+C to stop).")
+
+    try:
+        while True:
+            time.sleep(interval)
+            current = watch_snapshot(paths, image_dir)
+            if current != snapshot:
+                changed |= {path for path in current.keys() | snapshot.keys() if current.get(path) != snapshot.get(path)}
+                snapshot = current
+                last_change = time.monotonic()
+                continue
+            if not changed or time.monotonic() - last_change < quiet_period:
+                continue
+
+            data_changed = bool(changed.intersection(paths))
+            images_changed = bool(changed.difference(paths))
+            changed = set()
+
+            # Regroup the products only when the inventory changed, and skip the pages if the catalogue did not
+            new_products = products
+            if data_changed:
+                store.refresh()
+                new_products = site_builder.build_catalogue_model(store.available)
+            # Compared by repr so missing values, which are NaN, count as equal
+            if repr(new_products) == repr(products) and not images_changed:
+                print("Inventory changed, catalogue did not.")
+                continue
+
+            # Resize only when sources changed or new products need their images
+            if images_changed or site_builder.image_sources(new_products) != site_builder.image_sources(products):
+                images = site_builder.optimize_images(site_builder.image_sources(new_products))
+            products = new_products
+            site_builder.render_variants(products, variants, images)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+# Function to serve the catalogue from memory until interrupted with Ctrl+C. The inventory and images are checked every
+# interval seconds, and a sale or edit renders again only the pages showing the products it touched
+def serve_site(store, host='127.0.0.1', port=8000, variants=None, interval=1.0, image_dir='images'):
+    site = catalogue_server.CatalogueSite(variants or site_builder.CATALOGUE_VARIANTS)
+    paths = store.watch_paths() + [site_builder.EXCHANGE_RATES_FILE]
+
+    products = site_builder.build_catalogue_model(store.available)
+    images = site_builder.optimize_images(site_builder.image_sources(products))
+    site.update(products, images)
+
+    server = catalogue_server.start_server(site, host, port)
+    snapshot = watch_snapshot(paths, image_dir)
+    print(f"Serving the catalogue on http://{host}:{port}/ (Ctrl+C to stop).")
+
+    try:
+        while True:
+            time.sleep(interval)
+            current = watch_snapshot(paths, image_dir)
+            if current == snapshot:
+                continue
+            changed = {path for path in current.keys() | snapshot.keys() if current.get(path) != snapshot.get(path)}
+            snapshot = current
+
+            new_products = products
+            if changed.intersection(paths):
+                store.refresh()
+                new_products = site_builder.build_catalogue_model(store.available)
+            if changed.difference(paths) or site_builder.image_sources(new_products) != site_builder.image_sources(products):
+                images = site_builder.optimize_images(site_builder.image_sources(new_products))
+            products = new_products
+            site.update(products, images)
+    except KeyboardInterrupt:
+        print("Stopped serving.")
+    finally:
+        server.shutdown()
+        server.server_close()
 
-def generate_html(df, filename='index.html', include_price=False):
-    # Create a DataFrame to hold unique products and their sizes
-    unique_products = {}
-
-    # Sort the products based on the specified order: S, J, H, T, O
-    type_order = ['S', 'J', 'H', 'T', 'O']
-    
-    # Sort the dataframe by Type using a categorical type for the order
-    df['Type'] = pd.Categorical(df['Type'], categories=type_order, ordered=True)
-    df = df.sort_values('Type')  # Sort the DataFrame by Type
-
-    for _, row in df.iterrows():
-        product_id = row['ID']
-        
-        if product_id not in unique_products:
-            unique_products[product_id] = {
-                'Type': row['Type'],
-                'Brand': row['Brand'],
-                'Name': row['Name'],
-                'Color': row['Color'],
-                'Expected Price (USD)': row['Expected Price (USD)'],
-                'Sizes': [row['Sizes']],  # Convert sizes
-                'Image': f"images/{product_id}.png"  # Path to the image
-            }
-        else:
-            # If the product already exists, add the sizes to the list if not already present
-            if row['Sizes'] not in unique_products[product_id]['Sizes']:
-                unique_products[product_id]['Sizes'].append(row['Sizes'])
-    
-    # Start generating the HTML
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(f"""<html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>fily - de USA a ARG</title>
-
-            <!-- Favicon -->
-            <link rel="icon" href="favicon.ico" type="image/x-icon">
-
-            <!-- Google Fonts -->
-            <link href="https://fonts.googleapis.com/css2?family=YourCustomFont:wght@400;700&family=Open+Sans:wght@400;700&display=swap" rel="stylesheet">
-            <link href="https://fonts.googleapis.com/css2?family=IM+Fell+DW+Pica:ital@0;1&display=swap" rel="stylesheet">
-
-            <style>
-                body {{
-                    font-family: 'Open Sans', sans-serif;
-                    margin: 0;
-                    padding: 0;
-                    background-color: #f9f9f9;
-                    color: #333;
-                }}
-
-                header {{
-                    color: black;
-                    padding: 20px;
-                    text-align: center;
-                }}
-
-                header h1 {{
-                    font-family: 'IM Fell DW Pica', serif;
-                    font-size: 3.5em;
-                    margin: 0;
-                }}
-
-                header h2 {{
-                    font-family: 'IM Fell DW Pica', serif;
-                    font-size: 1.5em;
-                    margin: 20px 0;
-                }}
-
-                .social-media-icons {{
-                    display: flex;
-                    justify-content: center;
-                    align-items: center;
-                    gap: 10px;
-                }}
-
-                .social-media-icons img {{
-                    width: 30px;
-                    height: auto;
-                }}
-
-                .info-bar {{
-                    padding: 10px;
-                    text-align: center;
-                    margin-top: 10px;
-                    font-size: 0.9em;
-                    display: inline-block;
-                    width: 50%;
-                    border-top: 1px solid #333;
-                    border-bottom: 1px solid #333;
-                }}
-
-                .product-container {{
-                    display: flex;
-                    flex-wrap: wrap;
-                    justify-content: space-around;
-                    padding: 20px;
-                }}
-
-                .product {{
-                    background-color: white;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-                    margin: 20px;
-                    padding: 20px;
-                    width: calc(25% - 40px);
-                    text-align: center;
-                    transition: transform 0.2s;
-                }}
-
-                .product:hover {{
-                    transform: scale(1.05);
-                }}
-
-                .product img {{
-                    width: 100%;
-                    height: auto;
-                    max-width: 300px;
-                    object-fit: cover;
-                    object-position: center;
-                    border-bottom: 2px solid black;
-                    display: block;
-                    margin: 0 auto;
-                }}
-
-                .product h3 {{
-                    font-family: 'IM Fell DW Pica', serif;
-                    font-size: 1.2em;
-                    margin: 15px 0;
-                }}
-
-                .product p {{
-                    font-size: 1em;
-                    margin: 5px 0;
-                }}
-
-                .product-id {{
-                    font-size: 1em;
-                    margin: 5px 0;
-                    font-weight: bold;
-                }}
-
-                .price {{
-                    font-size: 1.2em;
-                    margin: 10px 0;
-                    font-weight: bold;
-                }}
-
-                .sizes-container {{
-                    display: flex;
-                    justify-content: center;
-                    gap: 5px;
-                    margin-top: 10px;
-                }}
-
-                .size {{
-                    padding: 5px 10px;
-                    border: 1px solid black;
-                    border-radius: 5px;
-                    font-size: 1em;
-                    background-color: white;
-                    color: black;
-                }}
-
-                footer {{
-                    background-color: #333;
-                    color: white;
-                    padding: 10px;
-                    text-align: center;
-                    position: fixed;
-                    width: 100%;
-                    bottom: 0;
-                }}
-
-                footer a {{
-                    color: white;
-                    font-weight: bold;
-                }}
-
-                @media (max-width: 768px) {{
-                    .product {{
-                        width: calc(50% - 40px);
-                    }}
-
-                    .info-bar {{
-                        width: 90%;
-                    }}
-
-                    .product img {{
-                        max-width: 100%;
-                    }}
-                }}
-
-                @media (max-width: 500px) {{
-                    .product {{
-                        width: calc(100% - 40px);
-                    }}
-
-                    .info-bar {{
-                        width: 90%;
-                    }}
-                }}
-            </style>
-            <script>
-                function openPopup() {{
-                    window.open('sizes.png', 'popup', 'width=600,height=600');
-                }}
-            </script>
-        </head>
-        <body>
-
-            <header>
-                <h1>fily</h1>
-                
-                <h2> ropa de USA a ARG </h2> 
-                
-                <div class="social-media-icons">
-                    <a href="https://www.instagram.com/fily.ropa/">
-                        <img src="instagram.png" alt="Instagram"> 
-                    </a>
-                    <a href="https://api.whatsapp.com/send?phone=5491122887256">
-                        <img src="whatsapp.png" alt="WhatsApp">
-                    </a>
-                </div>
-            </header>
-
-            <div class="product-container">
-        """)
-
-        for product_id, details in unique_products.items():
-            sizes_html = ''.join([f"<span class='size'>{size}</span>" for size in details['Sizes']])
-            price_without_decimal = int(details['Expected Price (USD)'])
-            price_ars = price_without_decimal * 1100  # ARS price conversion
-
-            # Include price only if requested (catalogue mode)
-            price_html = f"""
-                <p class='price'>${price_without_decimal} USD</p>
-                <p class='price'>${price_ars:,} ARS</p>
-            """ if include_price else ""
-
-            f.write(f"""
-                <div class="product">
-                    <img src='{details['Image']}' alt='{details['Name']}'>
-                    <h3>{details['Name']}</h3>
-                    <p class="product-id">ID: {product_id}</p>
-                    {price_html}
-                    <div class="sizes-container">
-                        {sizes_html}
-                    </div>
-                </div>
-            """)
-
-        f.write("""
-            </div>
-            <footer>
-                <p>Los talles de las zapatillas son de US Men.  
-                    <a href="javascript:void(0)" onclick="openPopup()">Tabla de Conversiones</a>.</p>
-            </footer>
-        </body>
-        </html>
-        """)
-
-    print(f"HTML file {filename} generated successfully.")
-
-# Function to create both internal and catalogue versions
-def create_html_files(df):
-    # Create the internal (without price) version
-    generate_html(df, filename='index.html', include_price=False)
-    
-    # Create the catalogue (with price) version
-    generate_html(df, filename='catalogue.html', include_price=True)
 
 # Function to search available items
-def search_available_items():
-    df = pd.read_csv(AVAILABLE_FILE)
+def search_available_items(store):
     search_term = input("Enter search term (leave blank for all items): ")
-    filtered_df = df[df['Name'].str.contains(search_term, case=False) | (search_term == '')]
+    sizes_filter = input("Only in sizes (comma separated, leave blank for any size): ").strip()
+    sizes_filter = [size for size in sizes_filter.split(',') if size.strip()] if sizes_filter else None
 
-    print(filtered_df)
+    products = find_products(store, search_term, sizes_filter)
+    print_search_results(products)
+    write_search_results(products)
 
-    # Generate HTML for search results
-    html_content = "<html><body><h1>Search Results</h1><table border='1'>"
-    html_content += "<tr><th>ID</th><th>Name</th><th>Available Sizes</th><th>Price</th><th>Image</th></tr>"
 
-    for index, row in filtered_df.iterrows():
-        sizes = ", ".join(row['Sizes'])
-        image_path = f"{row['ID']}.png"
-        html_content += f"<tr><td>{row['ID']}</td><td>{row['Name']}</td><td>{sizes}</td><td>{row['Expected Price (USD)']}</td><td><img src='{image_path}' alt='{row['Name']}' width='100'/></td></tr>"
+# Function to search the available products, ranked, one row per product with its list of sizes.
+# Words match the start of words in the ID, name, brand or color, allowing one typo in longer words
+def find_products(store, search_term, sizes_filter=None):
+    results = store.search(search_term, sizes_filter)
+    return pd.DataFrame([{'ID': product_id, **details, 'Score': score} for product_id, score, details in results],
+                        columns=['ID', 'Name', 'Brand', 'Expected Price (USD)', 'Sizes', 'Terms', 'Score']).drop(columns='Terms')
+
 
+def print_search_results(products):
+    print(products.assign(Sizes=products['Sizes'].str.join(', ')).to_string(index=False) if not products.empty else "No products found.")
+
+
+# Function to write search results to search_results.html
+def write_search_results(products, filename='search_results.html'):
+    # One row per product with all of its sizes
+    ids = products['ID'].astype(str).map(html.escape)
+    names = products['Name'].astype(str).map(html.escape)
+    sizes = products['Sizes'].str.join(', ').map(html.escape)
+
+    # Generate HTML for search results, building every table row with column-wise string operations
+    rows = ("<tr><td>" + ids + "</td><td>" + names + "</td><td>" + sizes + "</td><td>" + products['Expected Price (USD)'].astype(str)
+            + "</td><td><img src='" + ids + ".png' alt='" + names + "' width='100'/></td></tr>")
+
+    html_content = "<html><body><h1>Search Results</h1><table border='1'>"
+    html_content += "<tr><th>ID</th><th>Name</th><th>Available Sizes</th><th>Price</th><th>Image</th></tr>"
+    html_content += ''.join(rows)
     html_content += "</table></body></html>"
 
-    with open('search_results.html', 'w') as f:
+    with open(filename, 'w') as f:
         f.write(html_content)
 
     print("Search results HTML file created.")
 
 # Function to view sales records
-def view_sales_records():
-    sold_df = pd.read_csv(SOLD_FILE)
+def view_sales_records(store):
+    sold_df = store.sold
     print(sold_df)
 
 # Function to view available products
-def view_available_products():
-    df = pd.read_csv(AVAILABLE_FILE)  # Load from available.csv
-
-    # Ensure 'Sizes' column is treated as a string
-    df['Sizes'] = df['Sizes'].astype(str)
-
-    # Initialize a list to collect available products
-    available_products = []
-
-    for index, row in df.iterrows():
-        size = row['Sizes']  # Use the size directly
-        available_products.append({
-            'ID': row['ID'],
-            'Type': row['Type'],
-            'Gender': row['Gender'],
-            'Brand': row['Brand'],
-            'Name': row['Name'],
-            'Color': row['Color'],
-            'Cost (USD)': row['Cost (USD)'],
-            'Expected Price (USD)': row['Expected Price (USD)'],
-            'Trip #': row['Trip #'],
-            'Sizes': size,  # Show the available size
-            'Count': row['Count']  # Show the count for this size
-        })
-
-    # Create a DataFrame from the available products
-    available_df = pd.DataFrame(available_products)
+def view_available_products(store):
+    df = store.available
+
+    # One row per product: its details, the sizes still available and the total count
+    available_df = site_builder.group_products(df)
+    available_df['Sizes'] = available_df['Sizes'].str.join(', ')
 
     # Display the available products
     print(available_df)
@@ -527,8 +1334,8 @@ def view_available_products():
     return available_df  # Return the DataFrame for further use
 
 # Function to modify a product
-def modify_product():
-    df = pd.read_csv(PRODUCTS_FILE)
+def modify_product(store):
+    df = store.products
     
     product_id = input("Enter the product ID to modify: ")
     
@@ -542,60 +1349,61 @@ def modify_product():
     print(current_product)
     
     # Get the new values from the user (or leave unchanged if they press Enter)
-    new_type = input(f"Enter new type ({current_product['Type']}): ") or current_product['Type']
-    new_gender = input(f"Enter new gender ({current_product['Gender']}): ") or current_product['Gender']
-    new_brand = input(f"Enter new brand ({current_product['Brand']}): ") or current_product['Brand']
-    new_name = input(f"Enter new name ({current_product['Name']}): ") or current_product['Name']
-    new_color = input(f"Enter new color ({current_product['Color']}): ") or current_product['Color']
-    new_cost = input(f"Enter new cost ({current_product['Cost (USD)']}): ") or current_product['Cost (USD)']
-    new_price = input(f"Enter new expected price ({current_product['Expected Price (USD)']}): ") or current_product['Expected Price (USD)']
-    new_sizes = input(f"Enter new sizes ({current_product['Sizes']}): ") or current_product['Sizes']
-    new_trip_number = input(f"Enter new trip number ({current_product['Trip #']}): ") or current_product['Trip #']
-    
-    # Update the product in the DataFrame
-    df.loc[df['ID'] == product_id, ['Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Sizes', 'Trip #']] = \
-        [new_type, new_gender, new_brand, new_name, new_color, float(new_cost), float(new_price), new_sizes, new_trip_number]
-    
-    # Save the updated DataFrame
-    df.to_csv(PRODUCTS_FILE, index=False)
-    print(f"Product {product_id} updated successfully.")
-    
-    # Now update available.csv
-    available_df = pd.read_csv(AVAILABLE_FILE)
-    
-    # Remove the old entries for the product in available.csv
-    available_df = available_df[available_df['ID'] != product_id]
-    
-    # Add updated product sizes and counts back into available.csv
-    size_counts = {size.strip(): new_sizes.split(',').count(size.strip()) for size in new_sizes.split(',')}
-    
-    # Create a list of new rows to add
-    new_rows = []
-    for size, count in size_counts.items():
-        new_rows.append({
-            'ID': product_id,
-            'Type': new_type,
-            'Gender': new_gender,
-            'Brand': new_brand,
-            'Name': new_name,
-            'Color': new_color,
-            'Cost (USD)': float(new_cost),
-            'Expected Price (USD)': float(new_price),
-            'Trip #': new_trip_number,
-            'Sizes': size,
-            'Count': count
-        })
-    
-    # Concatenate the new rows to the available DataFrame
-    available_df = pd.concat([available_df, pd.DataFrame(new_rows)], ignore_index=True)
-    
-    # Save the updated available_df to available.csv
-    available_df.to_csv(AVAILABLE_FILE, index=False)
-    print(f"Product {product_id} updated in available.csv successfully.")
+    prompts = [('Type', 'type'), ('Gender', 'gender'), ('Brand', 'brand'), ('Name', 'name'), ('Color', 'color'), ('Cost (USD)', 'cost'),
+               ('Expected Price (USD)', 'expected price'), ('Sizes', 'sizes'), ('Trip #', 'trip number')]
+    changes = {}
+    for column, label in prompts:
+        value = input(f"Enter new {label} ({current_product[column]}): ")
+        if value:
+            changes[column] = value
+    update_product(store, product_id, changes)
+
+# Function to change the details of a product. Only new Sizes recount its available rows, so sales made so far are kept otherwise
+@retry_on_conflict
+def update_product(store, product_id, changes):
+    old_product = store.find_product(product_id)
+    if old_product.empty:
+        print("Product ID not found.")
+        return False
+
+    changes = dict(changes)
+    for column in ['Cost (USD)', 'Expected Price (USD)']:
+        if column in changes:
+            changes[column] = float(changes[column])
+    if 'Trip #' in changes:
+        changes['Trip #'] = pd.to_numeric(changes['Trip #'])  # Typed as text, but the column holds numbers
+
+    # Update the product
+    product = old_product.assign(**changes)
+    details = {column: value for column, value in changes.items() if column != 'Sizes'}
+
+    old_rows = store.find_available(product_id)
+    if 'Sizes' in changes:
+        # Recount the sizes: distinct sizes and total count for products.csv, one row per size for available.csv
+        product, new_rows = with_size_counts(product)
+        changes['Count'] = product['Count'].iloc[0]
+        changes['Sizes'] = product['Sizes'].iloc[0]
+    else:
+        new_rows = old_rows.assign(**details)
+
+    # Save products.csv and available.csv together, moving the product's amounts in the trip summary
+    summary = store.trip_summary()
+    with store.transaction():
+        store.update_rows('products', product_id, changes)
+        if 'Sizes' in changes:
+            # Replace the old entries for the product in available.csv with the new rows
+            store.delete_rows('available', product_id)
+            store.insert_rows('available', new_rows)
+        elif details:
+            store.update_rows('available', product_id, details)
+        summary.remove(products=old_product, available=old_rows)
+        summary.add(products=product, available=new_rows)
+    print(f"Product {product_id} updated in products.csv and available.csv successfully.")
+    return True
 
 # Function to delete a product
-def delete_product():
-    df = pd.read_csv(PRODUCTS_FILE)
+def delete_product(store):
+    df = store.products
     
     product_id = input("Enter the product ID to delete: ")
     
@@ -608,21 +1416,28 @@ def delete_product():
     if confirm != 'y':
         print("Deletion canceled.")
         return
-    
-    # Remove the product from the DataFrame
-    df = df[df['ID'] != product_id]
-    df.to_csv(PRODUCTS_FILE, index=False)
-    print(f"Product {product_id} deleted from products.csv.")
-    
-    # Now remove the product from available.csv
-    available_df = pd.read_csv(AVAILABLE_FILE)
-    available_df = available_df[available_df['ID'] != product_id]
-    available_df.to_csv(AVAILABLE_FILE, index=False)
-    print(f"Product {product_id} deleted from available.csv.")
+
+    if remove_product(store, product_id):
+        print(f"Product {product_id} deleted from products.csv and available.csv.")
+
+# Function to remove a product from products.csv and available.csv together, returning whether it was there
+@retry_on_conflict
+def remove_product(store, product_id):
+    product = store.find_product(product_id)
+    if product.empty:
+        print("Product ID not found.")
+        return False
+
+    summary = store.trip_summary()
+    available_rows = store.find_available(product_id)
+    store.delete_rows('products', product_id)
+    store.delete_rows('available', product_id)
+    summary.remove(products=product, available=available_rows)
+    return True
 
 # Function to modify a sale
-def modify_sale():
-    sold_df = pd.read_csv(SOLD_FILE)
+def modify_sale(store):
+    sold_df = store.sold.copy()
     
     product_id = input("Enter the product ID of the sale to modify: ")
     
@@ -636,23 +1451,42 @@ def modify_sale():
     print(f"\nCurrent details for sale of product {product_id}:")
     print(current_sale)
     
-    # Get the new sale values from the user
-    new_size_sold = input(f"Enter new size sold ({current_sale['Size Sold']}): ") or current_sale['Size Sold']
-    new_selling_date = input(f"Enter new selling date ({current_sale['Selling Date']}): ") or current_sale['Selling Date']
-    new_final_price = input(f"Enter new final price ({current_sale['Final Price']}): ") or current_sale['Final Price']
-    new_customer = input(f"Enter new customer name ({current_sale['Customer']}): ") or current_sale['Customer']
-    new_notes = input(f"Enter new notes ({current_sale['Notes']}): ") or current_sale['Notes']
-    
-    # Update the sale in the DataFrame
-    sold_df.loc[sold_df['ID'] == product_id, ['Size Sold', 'Selling Date', 'Final Price', 'Customer', 'Notes']] = \
-        [new_size_sold, new_selling_date, float(new_final_price), new_customer, new_notes]
-    
-    # Save the updated DataFrame
-    sold_df.to_csv(SOLD_FILE, index=False)
-    print(f"Sale record for product {product_id} updated successfully.")
+    # Get the new sale values from the user (or leave unchanged if they press Enter)
+    prompts = [('Size Sold', 'size sold'), ('Selling Date', 'selling date'), ('Final Price', 'final price'),
+               ('Customer', 'customer name'), ('Notes', 'notes')]
+    changes = {}
+    for column, label in prompts:
+        value = input(f"Enter new {label} ({current_sale[column]}): ")
+        if value:
+            changes[column] = value
+
+    if update_sale(store, product_id, changes):
+        print(f"Sale record for product {product_id} updated successfully.")
+
+# Function to change the sales of a product in sold.csv, moving them to their new cells of the rollup
+@retry_on_conflict
+def update_sale(store, product_id, changes):
+    old_sales = store.find_sales(product_id)
+    if old_sales.empty:
+        print("Product ID not found in sales records.")
+        return False
+
+    changes = dict(changes)
+    if 'Final Price' in changes:
+        changes['Final Price'] = float(changes['Final Price'])
+
+    # Save the updated sales and move them to their new cells of the rollup
+    rollup = store.sales_rollup()
+    store.update_rows('sold', product_id, changes)
+    rollup.remove(old_sales)
+    rollup.add(old_sales.assign(**changes))
+    return True
 
 # Main menu function
-def main_menu():
+def main_menu(backend='csv'):
+    # Load the inventory once for the whole session
+    store = open_store(backend)
+
     while True:
         print("\nMenu:")
         print("1. Add Product")
@@ -666,47 +1500,241 @@ def main_menu():
         print("9. Modify a Product")
         print("10. Delete a Product")
         print("11. Modify a Sale")
-        print("12. Exit")
+        print("12. Compact Sales Journal")
+        print("13. Import Trip Manifest")
+        print("14. Process Sales Sheet")
+        print("15. Watch and Rebuild Site")
+        print("16. Serve Catalogue")
+        print("17. Import CSV Files")
+        print("18. Export CSV Files")
+        print("19. Exit")
 
         choice = input("Choose an option: ")
         
         if choice == '1':
-            add_product()
+            add_product(store)
         elif choice == '2':
-            available_df = view_available_products()  # Save the DataFrame for use later
+            view_available_products(store)
         elif choice == '3':
-            process_sold_item()
+            process_sold_item(store)
         elif choice == '4':
-            calculate_expected_profit()
+            verify = input("Verify against a full recount? (y/n): ").lower() == 'y'
+            calculate_expected_profit(store, verify)
         elif choice == '5':
             start_date = input("Enter start date (YYYY-MM-DD): ")
             end_date = input("Enter end date (YYYY-MM-DD): ")
-            calculate_net_profit(start_date, end_date)
+            by = input(f"Break down by ({', '.join(sales_rollup.ROLLUP_KEYS)}; comma separated, leave blank for the total): ")
+            by = [key for key in sales_rollup.ROLLUP_KEYS if key.lower() in {part.strip().lower() for part in by.split(',')}]
+            calculate_net_profit(store, start_date, end_date, by)
         elif choice == '6':
-            create_html_files(available_df)  # Pass the available DataFrame to the generate_html function
+            create_html_files(store.available)  # Build the pages from the in-memory available DataFrame
         elif choice == '7':
-            search_available_items()
+            search_available_items(store)
         elif choice == '8':
-            view_sales_records()
+            view_sales_records(store)
         elif choice == '9':
-            modify_product()
+            modify_product(store)
         elif choice == '10':
-            delete_product()
+            delete_product(store)
         elif choice == '11':
-            modify_sale()
+            modify_sale(store)
         elif choice == '12':
+            store.compact()
+            print("Sales journal folded into sold.csv and available.csv.")
+        elif choice == '13':
+            manifest_file = input("Enter manifest file (CSV or JSON): ")
+            trip_number = input("Enter trip number (leave blank to use the manifest's Trip # column): ") or None
+            import_trip_manifest(store, manifest_file, trip_number)
+        elif choice == '14':
+            sheet_file = input("Enter sales sheet file (CSV): ")
+            process_sales_sheet(store, sheet_file)
+        elif choice == '15':
+            watch_site(store)
+        elif choice == '16':
+            port = input("Port (leave blank for 8000): ").strip()
+            serve_site(store, port=int(port) if port else 8000)
+        elif choice == '17':
+            import_csv_files(store)
+        elif choice == '18':
+            export_csv_files(store)
+        elif choice == '19':
+            # Fold the journaled sales back into the CSV files before leaving
+            store.compact()
             break
         else:
             print("Invalid choice. Please try again.")
 
-# Run the main menu
+# Function to load products.csv, available.csv and sold.csv into the store, replacing what it held
+def import_csv_files(store):
+    store.import_csv()
+    print(f"Inventory imported from {', '.join(store.paths.values())}.")
+
+# Function to write the store out as products.csv, available.csv and sold.csv
+def export_csv_files(store):
+    store.export_csv()
+    print(f"Inventory exported to {', '.join(store.paths.values())}.")
+
+# Function to create empty CSV files if they do not exist, writing just the header
+def create_missing_files():
+    for path, columns in [(PRODUCTS_FILE, PRODUCT_COLUMNS), (AVAILABLE_FILE, AVAILABLE_COLUMNS), (SOLD_FILE, SOLD_COLUMNS)]:
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f).writerow(columns)
+
+
+def run_add(store, args):
+    product_id = create_product(store, args.type, args.gender, args.brand, args.name, args.color, args.cost, args.price, args.trip, args.sizes)
+    print(product_id)
+
+
+def run_sell(store, args):
+    if args.sheet:
+        rejected = process_sales_sheet(store, args.sheet)
+        return 1 if len(rejected) else 0
+    if not sell_item(store, args.id, args.size, args.date, args.price, args.customer, args.notes):
+        return 1
+    print(f"Sold {args.id} in size {args.size}.")
+
+
+def run_import(store, args):
+    if not import_trip_manifest(store, args.manifest, args.trip):
+        return 1
+
+
+def run_report(store, args):
+    if args.report == 'expected':
+        calculate_expected_profit(store, args.verify)
+    else:
+        calculate_net_profit(store, args.start, args.end, args.by)
+
+
+def run_build_site(store, args):
+    if args.watch:
+        watch_site(store, interval=args.interval, quiet_period=args.quiet_period)
+    else:
+        create_html_files(store.available)
+
+
+def run_serve(store, args):
+    serve_site(store, args.host, args.port, interval=args.interval)
+
+
+def run_api(store, args):
+    inventory_api.serve(store, update_product, args.host, args.port)
+
+
+def run_import_csv(store, args):
+    import_csv_files(store)
+
+
+def run_export_csv(store, args):
+    export_csv_files(store)
+
+
+def run_compact(store, args):
+    store.compact()
+    print("Sales journal folded into sold.csv and available.csv.")
+
+
+def run_search(store, args):
+    sizes_filter = [size for size in args.sizes.split(',') if size.strip()] if args.sizes else None
+    products = find_products(store, ' '.join(args.query), sizes_filter)
+    print_search_results(products)
+    if args.html:
+        write_search_results(products, args.html)
+
+
+# Function to describe the command line: no command opens the menu, each subcommand does one job without prompts
+def build_parser():
+    parser = argparse.ArgumentParser(prog='importados.py', description="Inventory, sales and catalogue for fily.")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default=os.environ.get('IMPORTADOS_BACKEND', 'csv'),
+                        help="where the inventory is kept (default: $IMPORTADOS_BACKEND or csv)")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    add = commands.add_parser('add', help="add a product")
+    add.add_argument('--type', required=True, help="S = Sneakers, T = T-Shirts, H = Hoodies, J = Jacket, O = Other")
+    add.add_argument('--gender', required=True, help="J = Jordans, W = Women, M = Men, K = Kids, NG = No Gender")
+    add.add_argument('--brand', required=True)
+    add.add_argument('--name', required=True)
+    add.add_argument('--color', required=True)
+    add.add_argument('--cost', required=True, type=float, help="cost in USD")
+    add.add_argument('--price', required=True, type=float, help="expected price in USD")
+    add.add_argument('--trip', required=True)
+    add.add_argument('--sizes', required=True, help="comma separated, repeat a size for more than one unit")
+    add.set_defaults(handler=run_add)
+
+    sell = commands.add_parser('sell', help="record a sale, or a whole sales sheet")
+    sell.add_argument('id', nargs='?', help="product ID")
+    sell.add_argument('size', nargs='?')
+    sell.add_argument('--price', type=float, help="final price in USD")
+    sell.add_argument('--date', default=datetime.date.today().isoformat(), help="selling date (default: today)")
+    sell.add_argument('--customer', default='')
+    sell.add_argument('--notes', default='')
+    sell.add_argument('--sheet', help="CSV with ID, Size, Selling Date, Final Price, Customer, Notes")
+    sell.set_defaults(handler=run_sell)
+
+    manifest = commands.add_parser('import', help="import a trip manifest (CSV or JSON)")
+    manifest.add_argument('manifest')
+    manifest.add_argument('--trip', help="trip number, instead of the manifest's Trip # column")
+    manifest.set_defaults(handler=run_import)
+
+    report = commands.add_parser('report', help="expected profit per trip, or net profit for a period")
+    report.add_argument('report', choices=['expected', 'net'])
+    report.add_argument('--verify', action='store_true', help="check the expected profit summary against a full recount")
+    report.add_argument('--start', help="first selling date of the period (YYYY-MM-DD)")
+    report.add_argument('--end', help="last selling date of the period (YYYY-MM-DD)")
+    report.add_argument('--by', nargs='*', default=[], choices=['Day', 'Trip #', 'Type', 'Brand'], help="break the period down")
+    report.set_defaults(handler=run_report)
+
+    build = commands.add_parser('build-site', help="write the catalogue pages")
+    build.add_argument('--watch', action='store_true', help="keep rebuilding when the inventory or images change")
+    build.add_argument('--interval', type=float, default=1.0, help="seconds between checks when watching")
+    build.add_argument('--quiet-period', type=float, default=2.0, help="seconds without changes before rebuilding")
+    build.set_defaults(handler=run_build_site)
+
+    serve = commands.add_parser('serve', help="serve the catalogue from memory, updated as the inventory changes")
+    serve.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--interval', type=float, default=1.0, help="seconds between checks of the inventory and images")
+    serve.set_defaults(handler=run_serve)
+
+    api = commands.add_parser('api', help="serve a JSON API to list, search, reserve, sell and modify, safe for several clients at once")
+    api.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    api.add_argument('--port', type=int, default=8001)
+    api.set_defaults(handler=run_api)
+
+    import_csv = commands.add_parser('import-csv', help="replace the inventory with products.csv, available.csv and sold.csv")
+    import_csv.set_defaults(handler=run_import_csv)
+
+    export_csv = commands.add_parser('export-csv', help="write the inventory out as products.csv, available.csv and sold.csv")
+    export_csv.set_defaults(handler=run_export_csv)
+
+    compact = commands.add_parser('compact', help="fold the sales journal into sold.csv and available.csv, e.g. from cron")
+    compact.set_defaults(handler=run_compact)
+
+    search = commands.add_parser('search', help="search the available products")
+    search.add_argument('query', nargs='*', help="words to look for, nothing lists everything")
+    search.add_argument('--sizes', help="only products in one of these sizes (comma separated)")
+    search.add_argument('--html', nargs='?', const='search_results.html', help="also write the results as HTML")
+    search.set_defaults(handler=run_search)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'sell' and not args.sheet and not (args.id and args.size and args.price is not None):
+        parser.error("sell needs ID, SIZE and --price, or --sheet")
+    if args.command == 'report' and args.report == 'net' and not (args.start and args.end):
+        parser.error("report net needs --start and --end")
+
+    create_missing_files()
+    if args.command is None:
+        main_menu(args.backend)
+        return 0
+    return args.handler(open_store(args.backend), args) or 0
+
+
+# Run the command line, or the main menu when no command is given
 if __name__ == "__main__":
-    # Create empty CSV files if they do not exist
-    if not os.path.exists(PRODUCTS_FILE):
-        pd.DataFrame(columns=['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes']).to_csv(PRODUCTS_FILE, index=False)
-    if not os.path.exists(AVAILABLE_FILE):
-        pd.DataFrame(columns=['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes', 'Count']).to_csv(AVAILABLE_FILE, index=False)
-    if not os.path.exists(SOLD_FILE):
-        pd.DataFrame(columns=['ID', 'Type', 'Gender', 'Brand', 'Name', 'Color', 'Cost (USD)', 'Expected Price (USD)', 'Trip #', 'Sizes', 'Selling Date', 'Final Price', 'Customer', 'Notes']).to_csv(SOLD_FILE, index=False)
-
-    main_menu()
+    sys.exit(main())
@@ -0,0 +1,344 @@
+import asyncio
+import contextlib
+import datetime
+import itertools
+import json
+import time
+import urllib.parse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# How long a reservation holds a unit when the client does not say
+RESERVATION_SECONDS = 15 * 60
+
+# Most sales appended to the store in one write
+SALES_BATCH_SIZE = 256
+
+# Seconds without sales after which the stock is counted again from the files
+STOCK_REFRESH_SECONDS = 1.0
+
+# Fields a client may change on a product, and the columns they are kept in
+PRODUCT_FIELDS = {
+    'type': 'Type',
+    'gender': 'Gender',
+    'brand': 'Brand',
+    'name': 'Name',
+    'color': 'Color',
+    'cost': 'Cost (USD)',
+    'price': 'Expected Price (USD)',
+    'trip': 'Trip #',
+    'sizes': 'Sizes',
+}
+
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+               500: 'Internal Server Error'}
+
+
+# Exception for a request that cannot be answered, with the HTTP status to answer it with
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Function to list available rows as one entry per product with the count of each size
+def product_list(available_df):
+    if available_df.empty:
+        return []
+    counts = available_df.assign(Count=pd.to_numeric(available_df['Count'], errors='coerce').fillna(0)) \
+        .groupby(['ID', 'Sizes'], sort=False)['Count'].sum()
+    sizes = {}
+    for (product_id, size), count in counts.items():
+        sizes.setdefault(product_id, {})[size] = int(count)
+
+    details = available_df.drop_duplicates('ID').set_index('ID')[['Type', 'Brand', 'Name', 'Color', 'Expected Price (USD)']]
+    details = details.astype(object).where(details.notna(), None)
+    return [{'id': product_id, 'type': product_type, 'brand': brand, 'name': name, 'color': color, 'price': price, 'sizes': sizes[product_id]}
+            for product_id, (product_type, brand, name, color, price) in zip(details.index, details.itertuples(index=False, name=None))]
+
+
+# Class to sell, reserve and change the inventory for many clients at once.
+# Each (ID, size) has its own lock, held from the stock check until the sale is on disk, so the same unit is never sold
+# twice while sales of other items go ahead. Their writes are batched into one journal append
+class InventoryService:
+    def __init__(self, store, update_product):
+        self.store = store
+        # importados.update_product, passed in since importados is the one importing this module
+        self.update_product = update_product
+        # The store is not thread-safe, so every call to it runs on this one thread, away from the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.locks = defaultdict(asyncio.Lock)  # (ID, size) -> lock
+        self.stock = {}  # (ID, size) -> units on disk, recounted after every write
+        self.stock_frame = None
+        self.reservations = {}  # Reservation ID -> ((ID, size), expiry)
+        self.reservation_ids = itertools.count(1)
+        self.pending = []  # (sale, future) waiting to be written
+        self.wakeup = asyncio.Event()
+        self.writer = None
+        self.sold = 0
+
+    async def start(self):
+        await self.run(self.count_stock)
+        self.writer = asyncio.create_task(self.write_sales())
+
+    # Stop writing, then fold the journaled sales into the CSV files so the next start does not replay them all
+    async def stop(self):
+        self.writer.cancel()
+        await self.run(self.store.compact)
+        self.executor.shutdown()
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    # Count the units of every (ID, size) again if the available rows changed. Runs on the store thread
+    def count_stock(self):
+        available = self.store.available
+        if available is not self.stock_frame:
+            counts = pd.to_numeric(available['Count'], errors='coerce').fillna(0).groupby([available['ID'], available['Sizes']]).sum()
+            self.stock = {key: int(count) for key, count in counts.items()}
+            self.stock_frame = available
+
+    # Turn sales into sold rows with the details of their available rows and append them all at once. Runs on the store thread
+    def write_batch(self, sales):
+        sales_df = pd.DataFrame(sales, columns=['ID', 'Size Sold', 'Selling Date', 'Final Price', 'Customer', 'Notes'])
+        # Number repeated sales of the same item so only as many as are in stock go through
+        sales_df['Unit'] = sales_df.groupby(['ID', 'Size Sold']).cumcount() + 1
+
+        # Checked again on the files as saved, since other sessions may have sold the same units
+        def journal_in_stock():
+            details = self.store.available.drop_duplicates(['ID', 'Sizes']).rename(columns={'Sizes': 'Size Sold'})
+            entries_df = sales_df.merge(details, on=['ID', 'Size Sold'], how='left')
+            entries_df['Sizes'] = entries_df['Size Sold']
+            in_stock = entries_df['Unit'] <= entries_df['Count']
+            if in_stock.any():
+                self.store.journal_sales(entries_df[in_stock])
+            return in_stock.tolist()
+
+        in_stock = self.store.apply(journal_in_stock)
+        self.count_stock()
+        return in_stock
+
+    # Write the pending sales in batches, telling each sale once it is on disk. When nothing is sold for a while, count
+    # the stock again so edits made to the files by anyone else are seen
+    async def write_sales(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), STOCK_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                await self.run(self.count_stock)
+                continue
+            self.wakeup.clear()
+            while self.pending:
+                batch, self.pending = self.pending[:SALES_BATCH_SIZE], self.pending[SALES_BATCH_SIZE:]
+                try:
+                    in_stock = await self.run(self.write_batch, [sale for sale, _ in batch])
+                except Exception as error:
+                    await self.run(self.count_stock)
+                    for _, future in batch:
+                        future.set_exception(error)
+                else:
+                    for (sale, future), sold in zip(batch, in_stock):
+                        if sold:
+                            future.set_result(None)
+                        else:
+                            future.set_exception(ApiError(409, f"{sale[0]} is not available in size {sale[1]}."))
+
+    def expire_reservations(self):
+        now = time.monotonic()
+        for reservation_id, (_, expiry) in list(self.reservations.items()):
+            if expiry <= now:
+                del self.reservations[reservation_id]
+
+    # Units of an (ID, size) held by reservations other than keep
+    def held(self, key, keep=None):
+        self.expire_reservations()
+        return sum(1 for reservation_id, (reserved, _) in self.reservations.items() if reserved == key and reservation_id != keep)
+
+    # Units of an (ID, size) that can still be sold or reserved. Only called with the lock of the (ID, size) held
+    def free_units(self, key, keep=None):
+        if key not in self.stock:
+            raise ApiError(409, f"{key[0]} is not available in size {key[1]}.")
+        return self.stock[key] - self.held(key, keep)
+
+    async def products(self):
+        available = await self.run(lambda: self.store.available)
+        return self.without_held(product_list(available))
+
+    async def product(self, product_id):
+        products = product_list(await self.run(self.store.find_available, product_id))
+        if not products:
+            raise ApiError(404, f"{product_id} is not available.")
+        return self.without_held(products)[0]
+
+    # Take the reserved units out of the size counts
+    def without_held(self, products):
+        self.expire_reservations()
+        by_id = {product['id']: product for product in products}
+        for (product_id, size), _ in self.reservations.values():
+            if product_id in by_id and size in by_id[product_id]['sizes']:
+                by_id[product_id]['sizes'][size] -= 1
+        return products
+
+    async def search(self, query, sizes=None):
+        results = await self.run(self.store.search, query, sizes)
+        return [{'id': product_id, 'score': score, 'name': details['Name'], 'brand': details['Brand'],
+                 'price': details['Expected Price (USD)'], 'sizes': details['Sizes']} for product_id, score, details in results]
+
+    async def reserve(self, product_id, size, seconds=RESERVATION_SECONDS):
+        key = (product_id, size)
+        async with self.locks[key]:
+            if self.free_units(key) < 1:
+                raise ApiError(409, f"{product_id} in size {size} is sold out or reserved.")
+            reservation_id = str(next(self.reservation_ids))
+            self.reservations[reservation_id] = (key, time.monotonic() + seconds)
+        return {'reservation': reservation_id, 'id': product_id, 'size': size, 'seconds': seconds}
+
+    def release(self, reservation_id):
+        if self.reservations.pop(reservation_id, None) is None:
+            raise ApiError(404, f"Reservation {reservation_id} not found or expired.")
+        return {'released': reservation_id}
+
+    # Sell one unit, from a reservation when given. Answers once the sale is on disk
+    async def sell(self, product_id, size, final_price, selling_date=None, customer='', notes='', reservation=None):
+        key = (product_id, size)
+        async with self.locks[key]:
+            self.expire_reservations()
+            if reservation is not None and self.reservations.get(reservation, (None,))[0] != key:
+                raise ApiError(409, f"Reservation {reservation} is not for {product_id} in size {size}, or expired.")
+            if self.free_units(key, keep=reservation) < 1:
+                raise ApiError(409, f"{product_id} in size {size} is sold out or reserved.")
+
+            selling_date = selling_date or datetime.date.today().isoformat()
+            future = asyncio.get_running_loop().create_future()
+            self.pending.append(((product_id, size, selling_date, final_price, customer, notes), future))
+            self.wakeup.set()
+            await future
+
+            self.reservations.pop(reservation, None)
+            self.sold += 1
+        return {'id': product_id, 'size': size, 'price': final_price, 'date': selling_date}
+
+    # Change a product. New sizes recount every size of the product, so all of them are locked, always in the same order
+    async def modify(self, product_id, changes):
+        sizes = set()
+        if 'Sizes' in changes:
+            current = await self.run(self.store.find_available, product_id)
+            sizes = {str(size).strip() for size in current['Sizes']} | {size.strip() for size in str(changes['Sizes']).split(',') if size.strip()}
+        async with contextlib.AsyncExitStack() as stack:
+            for size in sorted(sizes):
+                await stack.enter_async_context(self.locks[(product_id, size)])
+            found = await self.run(self.update_product, self.store, product_id, changes)
+            await self.run(self.count_stock)
+            if not found:
+                raise ApiError(404, f"Product {product_id} not found.")
+        return await self.product(product_id)
+
+    # Route a request to the service and return the status and the JSON answer
+    async def dispatch(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+        parts = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/')]
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {'error': "The body is not valid JSON."}
+
+        try:
+            if parts == ['products'] and method == 'GET':
+                return 200, await self.products()
+            if len(parts) == 2 and parts[0] == 'products' and method == 'GET':
+                return 200, await self.product(parts[1])
+            if len(parts) == 2 and parts[0] == 'products' and method == 'PATCH':
+                unknown = set(data) - set(PRODUCT_FIELDS)
+                if unknown:
+                    raise ApiError(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+                return 200, await self.modify(parts[1], {PRODUCT_FIELDS[field]: value for field, value in data.items()})
+            if parts == ['search'] and method == 'GET':
+                sizes = [size for size in query.get('sizes', [''])[0].split(',') if size.strip()] or None
+                return 200, await self.search(query.get('q', [''])[0], sizes)
+            if parts == ['reservations'] and method == 'POST':
+                return 201, await self.reserve(str(data['id']), str(data['size']), float(data.get('seconds', RESERVATION_SECONDS)))
+            if len(parts) == 2 and parts[0] == 'reservations' and method == 'DELETE':
+                return 200, self.release(parts[1])
+            if parts == ['sales'] and method == 'POST':
+                reservation = data.get('reservation')
+                return 201, await self.sell(str(data['id']), str(data['size']), float(data['price']), data.get('date'),
+                                            data.get('customer', ''), data.get('notes', ''), None if reservation is None else str(reservation))
+            if parts[0] in ('products', 'search', 'reservations', 'sales'):
+                return 405, {'error': f"{method} is not allowed on {url.path}."}
+            return 404, {'error': f"Nothing at {url.path}."}
+        except ApiError as error:
+            return error.status, {'error': str(error)}
+        except KeyError as error:
+            return 400, {'error': f"Missing field {error}."}
+        except (TypeError, ValueError) as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            print(f"Request {method} {target} failed: {error!r}")
+            return 500, {'error': "The request failed."}
+
+    # Answer HTTP/1.1 requests on one connection, keeping it open between requests unless the client closes it
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else b''
+
+                status, answer = await self.dispatch(method.upper(), target, body)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                content = json.dumps(answer, ensure_ascii=False).encode('utf-8')
+                connection = '' if keep_alive else 'Connection: close\r\n'
+                head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                        f"Content-Length: {len(content)}\r\n{connection}\r\n")
+                writer.write(head.encode('latin-1') + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+# Function to start the API on host and port, returning the service and the server
+async def start_api(store, update_product, host='127.0.0.1', port=8001):
+    service = InventoryService(store, update_product)
+    await service.start()
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    return service, server
+
+
+# Function to serve the API until the process is interrupted
+async def serve_api(store, update_product, host='127.0.0.1', port=8001):
+    service, server = await start_api(store, update_product, host, port)
+    print(f"Inventory API on http://{host}:{port}/ (Ctrl+C to stop).")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+# Function to run the API until interrupted with Ctrl+C
+def serve(store, update_product, host='127.0.0.1', port=8001):
+    try:
+        asyncio.run(serve_api(store, update_product, host, port))
+    except KeyboardInterrupt:
+        print("Stopped the inventory API.")
@@ -0,0 +1,158 @@
+import bisect
+
+from site_builder import search_terms
+
+# How much a match in each column counts towards a product's rank
+FIELD_WEIGHTS = {'ID': 3, 'Name': 3, 'Brand': 2, 'Color': 1}
+
+# A whole word beats the start of a word, which beats a word with a typo
+EXACT_MATCH = 3
+PREFIX_MATCH = 2
+TYPO_MATCH = 1
+
+# Words shorter than this must be typed correctly, otherwise almost anything would match
+TYPO_MIN_LENGTH = 4
+
+
+# Function to tell whether a word may match with a typo. IDs and sizes have digits and must be typed exactly
+def allows_typos(term):
+    return len(term) >= TYPO_MIN_LENGTH and term.isalpha()
+
+
+# Function to list the words made by dropping one letter, used to find words one typo away
+def deletions(term):
+    return {term[:position] + term[position + 1:] for position in range(len(term))}
+
+
+# Function to check that two words differ by at most one inserted, removed, changed or swapped letter
+def one_typo_apart(a, b):
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+
+    start = 0
+    while start < len(a) and a[start] == b[start]:
+        start += 1
+    if len(a) < len(b):
+        return a[start:] == b[start + 1:]
+    if a[start + 1:] == b[start + 1:]:
+        return True
+    # Two neighbouring letters swapped
+    return a[start:start + 2] == b[start:start + 2][::-1] and a[start + 2:] == b[start + 2:]
+
+
+# Class to search the available products by words of their ID, name, brand and color
+class ProductSearch:
+    def __init__(self, available_df=None):
+        self.products = {}
+        self.postings = {}  # Word -> {product ID: weight}
+        self.terms = []  # Every word, sorted for prefix lookups
+        self.typos = {}  # Word with one letter dropped -> words it came from
+        if available_df is not None:
+            self.update(available_df)
+
+    # Re-index the products in available_df. Products listed in product_ids without rows in available_df are removed
+    def update(self, available_df, product_ids=None):
+        product_ids = set(available_df['ID']) if product_ids is None else set(product_ids)
+        for product_id in product_ids:
+            self.remove(product_id)
+
+        rows = available_df[available_df['ID'].isin(product_ids)]
+
+        # Distinct sizes of each product in file order, then one pass over the first row of each product
+        sizes = {}
+        for product_id, size in zip(rows['ID'], rows['Sizes'].astype(str)):
+            sizes.setdefault(product_id, {})[size] = None
+        columns = ['ID', 'Name', 'Brand', 'Color', 'Expected Price (USD)']
+        for product_id, name, brand, color, price in rows.drop_duplicates('ID')[columns].itertuples(index=False, name=None):
+            fields = {'ID': product_id, 'Name': name, 'Brand': brand, 'Color': color}
+            weights = {}
+            for column, weight in FIELD_WEIGHTS.items():
+                for term in search_terms(fields[column]):
+                    weights[term] = max(weights.get(term, 0), weight)
+
+            self.products[product_id] = {
+                'Name': name,
+                'Brand': brand,
+                'Expected Price (USD)': price,
+                'Sizes': list(sizes[product_id]),
+                'Terms': weights,
+            }
+            for term, weight in weights.items():
+                self.add_term(term, product_id, weight)
+
+    def add_term(self, term, product_id, weight):
+        if term not in self.postings:
+            self.postings[term] = {}
+            bisect.insort(self.terms, term)
+            if allows_typos(term):
+                for deletion in deletions(term) | {term}:
+                    self.typos.setdefault(deletion, set()).add(term)
+        self.postings[term][product_id] = weight
+
+    def remove(self, product_id):
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return
+        for term in product['Terms']:
+            postings = self.postings[term]
+            del postings[product_id]
+            if postings:
+                continue
+
+            # Nobody uses the word anymore
+            del self.postings[term]
+            del self.terms[bisect.bisect_left(self.terms, term)]
+            if allows_typos(term):
+                for deletion in deletions(term) | {term}:
+                    self.typos[deletion].discard(term)
+                    if not self.typos[deletion]:
+                        del self.typos[deletion]
+
+    # Best score of every product for one word of the query
+    def match(self, word):
+        scores = {}
+
+        def add(term, strength):
+            for product_id, weight in self.postings[term].items():
+                scores[product_id] = max(scores.get(product_id, 0), weight * strength)
+
+        # Words starting with the query word, the word itself included
+        position = bisect.bisect_left(self.terms, word)
+        while position < len(self.terms) and self.terms[position].startswith(word):
+            term = self.terms[position]
+            add(term, EXACT_MATCH if term == word else PREFIX_MATCH)
+            position += 1
+
+        if allows_typos(word):
+            candidates = set()
+            for deletion in deletions(word) | {word}:
+                candidates |= self.typos.get(deletion, set())
+            for term in candidates:
+                if term != word and one_typo_apart(term, word):
+                    add(term, TYPO_MATCH)
+        return scores
+
+    # Products matching every word of the query, best first, optionally only those in one of the given sizes
+    def search(self, query, sizes=None):
+        scores = None
+        for word in search_terms(query):
+            word_scores = self.match(word)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {product_id: score + word_scores[product_id] for product_id, score in scores.items() if product_id in word_scores}
+
+        # An empty query lists everything
+        if scores is None:
+            scores = dict.fromkeys(self.products, 0)
+
+        if sizes:
+            wanted = {str(size).strip() for size in sizes}
+            scores = {product_id: score for product_id, score in scores.items() if wanted.intersection(self.products[product_id]['Sizes'])}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(product_id, score, self.products[product_id]) for product_id, score in ranked]
@@ -0,0 +1,109 @@
+import pandas as pd
+
+# One cell per day, trip, type and brand, holding the revenue, cost and number of units sold
+ROLLUP_KEYS = ['Day', 'Trip #', 'Type', 'Brand']
+ROLLUP_MEASURES = ['Revenue', 'Cost', 'Units']
+
+
+# Function to turn trip numbers into text keys, so 1, 1.0 and '1' all land in the same cell
+def trip_keys(trips):
+    keys = pd.to_numeric(trips, errors='coerce').astype('Int64').astype(str)
+    return keys.where(keys != '<NA>', '')
+
+
+# Function to total sales rows into rollup cells, keyed by text so cells match however a value was typed
+def rollup_cells(sales_df):
+    if sales_df.empty:
+        return pd.DataFrame(columns=ROLLUP_KEYS + ROLLUP_MEASURES)
+
+    cells = pd.DataFrame({
+        'Day': pd.to_datetime(sales_df['Selling Date'], errors='coerce', format='mixed').dt.strftime('%Y-%m-%d').fillna(''),
+        'Trip #': trip_keys(sales_df['Trip #']),
+        'Type': sales_df['Type'].fillna('').astype(str),
+        'Brand': sales_df['Brand'].fillna('').astype(str),
+        'Revenue': pd.to_numeric(sales_df['Final Price'], errors='coerce').fillna(0),
+        'Cost': pd.to_numeric(sales_df['Cost (USD)'], errors='coerce').fillna(0),
+        'Units': 1,
+    })
+    return cells.groupby(ROLLUP_KEYS, as_index=False)[ROLLUP_MEASURES].sum()
+
+
+# Function to total the cells of a period by some of the dimensions, with the margin of each row
+def summarize_cells(cube, start_date=None, end_date=None, by=()):
+    if start_date:
+        cube = cube[cube['Day'] >= pd.to_datetime(start_date).strftime('%Y-%m-%d')]
+    if end_date:
+        cube = cube[(cube['Day'] <= pd.to_datetime(end_date).strftime('%Y-%m-%d')) & (cube['Day'] != '')]
+
+    by = list(by)
+    if by:
+        summary = cube.groupby(by, as_index=False)[ROLLUP_MEASURES].sum()
+    else:
+        summary = pd.DataFrame([cube[ROLLUP_MEASURES].sum()], columns=ROLLUP_MEASURES)
+    summary['Margin'] = summary['Revenue'] - summary['Cost']
+    summary[['Revenue', 'Cost', 'Margin']] = summary[['Revenue', 'Cost', 'Margin']].astype(float).round(2)
+    summary['Units'] = summary['Units'].astype(int)
+    return summary[by + ['Revenue', 'Cost', 'Margin', 'Units']]
+
+
+# Class to keep the sales rollup in memory, saved next to the CSV files between sessions
+class SalesRollup:
+    def __init__(self, cells=()):
+        self.cells = {}  # (day, trip, type, brand) -> [revenue, cost, units]
+        for *key, revenue, cost, units in cells:
+            self.cells[tuple(key)] = [revenue, cost, units]
+
+    # Add sales to their cells, or take them out again with sign=-1
+    def add(self, sales_df, sign=1):
+        for *key, revenue, cost, units in rollup_cells(sales_df).itertuples(index=False, name=None):
+            cell = self.cells.setdefault(tuple(key), [0.0, 0.0, 0])
+            cell[0] += sign * revenue
+            cell[1] += sign * cost
+            cell[2] += sign * int(units)
+            if cell[2] <= 0:
+                del self.cells[tuple(key)]
+
+    def remove(self, sales_df):
+        self.add(sales_df, sign=-1)
+
+    # Cells as rows for saving
+    def rows(self):
+        return [[*key, *cell] for key, cell in sorted(self.cells.items())]
+
+    def frame(self):
+        return pd.DataFrame(self.rows(), columns=ROLLUP_KEYS + ROLLUP_MEASURES)
+
+    def summary(self, start_date=None, end_date=None, by=()):
+        return summarize_cells(self.frame(), start_date, end_date, by)
+
+
+# Class to keep the sales rollup as a table of the SQLite database, updated in the same transactions as sold
+class SqliteSalesRollup:
+    def __init__(self, conn):
+        self.conn = conn
+        keys = ', '.join(f'"{key}"' for key in ROLLUP_KEYS)
+        columns = ', '.join(f'"{key}" TEXT NOT NULL' for key in ROLLUP_KEYS)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS sales_rollup ({columns}, "Revenue" REAL, "Cost" REAL, "Units" INTEGER, PRIMARY KEY ({keys}))')
+
+    def add(self, sales_df, sign=1):
+        rows = [(*key, sign * float(revenue), sign * float(cost), sign * int(units))
+                for *key, revenue, cost, units in rollup_cells(sales_df).itertuples(index=False, name=None)]
+        self.conn.executemany('INSERT INTO sales_rollup VALUES (?, ?, ?, ?, ?, ?, ?) '
+                              'ON CONFLICT ("Day", "Trip #", "Type", "Brand") DO UPDATE SET '
+                              '"Revenue" = "Revenue" + excluded."Revenue", "Cost" = "Cost" + excluded."Cost", '
+                              '"Units" = "Units" + excluded."Units"', rows)
+        self.conn.execute('DELETE FROM sales_rollup WHERE "Units" <= 0')
+
+    def remove(self, sales_df):
+        self.add(sales_df, sign=-1)
+
+    # Throw the cells away and total the given sales again
+    def rebuild(self, sales_df):
+        self.conn.execute('DELETE FROM sales_rollup')
+        self.add(sales_df)
+
+    def frame(self):
+        return pd.read_sql_query('SELECT * FROM sales_rollup', self.conn)
+
+    def summary(self, start_date=None, end_date=None, by=()):
+        return summarize_cells(self.frame(), start_date, end_date, by)
@@ -0,0 +1,1026 @@
+import datetime
+import functools
+import gzip
+import hashlib
+import html
+import json
+import os
+import re
+import unicodedata
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Pillow is optional, without it the cards link the original images
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Page, card, price, size and image templates. $name is escaped, $!name is inserted as it is, $$ is a dollar sign
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TEMPLATE_PATTERN = re.compile(r'\$(\$|!?\w+)')
+CARD_TEMPLATES = ['card.html', 'price.html', 'size.html', 'image.html', 'picture.html']
+
+# Cache of rendered product cards, kept between builds
+BUILD_DIR = '.build'
+FRAGMENT_CACHE_FILE = os.path.join(BUILD_DIR, 'fragments.json')
+
+# Resized copies of the product images, named after the source hash so they can be cached forever
+VARIANT_DIR = os.path.join('images', 'variants')
+IMAGE_MANIFEST_FILE = os.path.join(BUILD_DIR, 'images.json')
+IMAGE_WIDTHS = [320, 640, 960]
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+# Pages written from one product model: the internal page without prices and the priced catalogue.
+# A variant can also keep only some product types, e.g. {'filename': 'zapas.html', 'include_price': True, 'types': ['S']},
+# and set its own number of cards per page with 'page_size'
+CATALOGUE_VARIANTS = [
+    {'filename': 'index.html', 'include_price': False},
+    {'filename': 'catalogue.html', 'include_price': True},
+]
+
+# Exchange rates, one row per currency and date the rate applies from: Date, Currency, Rate (per USD), Step and Rounding.
+# Prices are rounded to a multiple of Step, to the nearest one, up or down. The newest rate of each currency is used
+EXCHANGE_RATES_FILE = 'exchange_rates.csv'
+EXCHANGE_RATE_COLUMNS = ['Date', 'Currency', 'Rate', 'Step', 'Rounding']
+
+# Rates used without a table: whole dollars and pesos at 1100 per dollar
+DEFAULT_EXCHANGE_RATES = [['', 'USD', 1.0, 1, 'nearest'], ['', 'ARS', 1100.0, 100, 'nearest']]
+
+# Ways to round a number of steps to a whole one
+ROUNDING_MODES = {'nearest': lambda steps: np.floor(steps + 0.5), 'up': np.ceil, 'down': np.floor}
+
+# Order of the product types on the pages: S, J, H, T, O
+TYPE_ORDER = ['S', 'J', 'H', 'T', 'O']
+TYPE_NAMES = {'S': 'Zapatillas', 'J': 'Camperas', 'H': 'Buzos', 'T': 'Remeras', 'O': 'Otros'}
+
+# Cards per page. Later pages are loaded as the customer scrolls, or followed as plain links without JavaScript
+PAGE_SIZE = 24
+
+# Words of the search index: letters and digits, keeping sizes like 9.5 whole
+SEARCH_TERM_PATTERN = re.compile(r'[a-z0-9]+(?:\.[0-9]+)?')
+
+# Pages written by the last build of each variant, so pages that are no longer needed can be removed
+PAGE_MANIFEST_FILE = os.path.join(BUILD_DIR, 'pages.json')
+
+# Fingerprinted CSS/JS bundle and the self-hosted font
+ASSET_DIR = 'assets'
+FONT_ARCHIVE = os.path.join('images', 'IM_Fell_DW_Pica.zip')
+FONT_FACES = {'IMFellDWPica-Regular.ttf': 'normal', 'IMFellDWPica-Italic.ttf': 'italic'}
+
+# Cards take a quarter of the page on desktop, half on tablets and all of it on phones
+IMAGE_SIZES = '(max-width: 500px) 100vw, (max-width: 768px) 50vw, 25vw'
+
+# Styles shared by every generated page, written once as a fingerprinted bundle
+STYLESHEET = """
+body {
+    font-family: 'Open Sans', -apple-system, 'Segoe UI', Roboto, Helvetica, Arial, sans-serif;
+    margin: 0;
+    padding: 0;
+    background-color: #f9f9f9;
+    color: #333;
+}
+
+header {
+    color: black;
+    padding: 20px;
+    text-align: center;
+}
+
+header h1 {
+    font-family: 'IM Fell DW Pica', serif;
+    font-size: 3.5em;
+    margin: 0;
+}
+
+header h2 {
+    font-family: 'IM Fell DW Pica', serif;
+    font-size: 1.5em;
+    margin: 20px 0;
+}
+
+.social-media-icons {
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    gap: 10px;
+}
+
+.social-media-icons img {
+    width: 30px;
+    height: auto;
+}
+
+.info-bar {
+    padding: 10px;
+    text-align: center;
+    margin-top: 10px;
+    font-size: 0.9em;
+    display: inline-block;
+    width: 50%;
+    border-top: 1px solid #333;
+    border-bottom: 1px solid #333;
+}
+
+.sections {
+    display: flex;
+    flex-wrap: wrap;
+    justify-content: center;
+    gap: 10px;
+    padding: 10px;
+}
+
+.sections a {
+    color: #333;
+    text-decoration: none;
+    padding: 5px 10px;
+    border: 1px solid #333;
+    border-radius: 5px;
+}
+
+.sections a.current {
+    background-color: #333;
+    color: white;
+}
+
+.next-page {
+    display: block;
+    text-align: center;
+    margin: 20px auto 80px;
+    color: #333;
+    font-weight: bold;
+}
+
+.search {
+    position: relative;
+    width: 50%;
+    margin: 10px auto 0;
+}
+
+.search input {
+    width: 100%;
+    box-sizing: border-box;
+    padding: 8px 12px;
+    font-size: 1em;
+    border: 1px solid #333;
+    border-radius: 5px;
+}
+
+.search-results {
+    position: absolute;
+    z-index: 10;
+    left: 0;
+    right: 0;
+    margin: 0;
+    padding: 0;
+    list-style: none;
+    background-color: white;
+    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
+    text-align: left;
+}
+
+.search-results a {
+    display: block;
+    padding: 8px 12px;
+    color: #333;
+    text-decoration: none;
+}
+
+.search-results a:hover {
+    background-color: #f0f0f0;
+}
+
+.product-container {
+    display: flex;
+    flex-wrap: wrap;
+    justify-content: space-around;
+    padding: 20px;
+}
+
+.product {
+    background-color: white;
+    border-radius: 8px;
+    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
+    margin: 20px;
+    padding: 20px;
+    width: calc(25% - 40px);
+    text-align: center;
+    transition: transform 0.2s;
+}
+
+.product:hover {
+    transform: scale(1.05);
+}
+
+.product img {
+    width: 100%;
+    height: auto;
+    max-width: 300px;
+    object-fit: cover;
+    object-position: center;
+    border-bottom: 2px solid black;
+    display: block;
+    margin: 0 auto;
+}
+
+.product h3 {
+    font-family: 'IM Fell DW Pica', serif;
+    font-size: 1.2em;
+    margin: 15px 0;
+}
+
+.product p {
+    font-size: 1em;
+    margin: 5px 0;
+}
+
+.product-id {
+    font-size: 1em;
+    margin: 5px 0;
+    font-weight: bold;
+}
+
+.price {
+    font-size: 1.2em;
+    margin: 10px 0;
+    font-weight: bold;
+}
+
+.sizes-container {
+    display: flex;
+    justify-content: center;
+    gap: 5px;
+    margin-top: 10px;
+}
+
+.size {
+    padding: 5px 10px;
+    border: 1px solid black;
+    border-radius: 5px;
+    font-size: 1em;
+    background-color: white;
+    color: black;
+}
+
+footer {
+    background-color: #333;
+    color: white;
+    padding: 10px;
+    text-align: center;
+    position: fixed;
+    width: 100%;
+    bottom: 0;
+}
+
+footer a {
+    color: white;
+    font-weight: bold;
+}
+
+@media (max-width: 768px) {
+    .product {
+        width: calc(50% - 40px);
+    }
+
+    .info-bar {
+        width: 90%;
+    }
+
+    .search {
+        width: 90%;
+    }
+
+    .product img {
+        max-width: 100%;
+    }
+}
+
+@media (max-width: 500px) {
+    .product {
+        width: calc(100% - 40px);
+    }
+
+    .info-bar {
+        width: 90%;
+    }
+}
+"""
+
+SCRIPT = """
+function openPopup() {
+    window.open('sizes.png', 'popup', 'width=600,height=600');
+}
+
+// Append the cards of the next page when its link comes close to the screen
+document.addEventListener('DOMContentLoaded', function () {
+    var next = document.querySelector('.next-page');
+    if (!next || !('IntersectionObserver' in window) || !window.fetch) {
+        return;
+    }
+    var container = document.querySelector('.product-container');
+    var loading = false;
+    var observer = new IntersectionObserver(function (entries) {
+        if (!entries[0].isIntersecting || loading) {
+            return;
+        }
+        loading = true;
+        fetch(next.href).then(function (response) {
+            return response.text();
+        }).then(function (text) {
+            var page = new DOMParser().parseFromString(text, 'text/html');
+            page.querySelectorAll('.product-container .product').forEach(function (card) {
+                container.appendChild(document.adoptNode(card));
+            });
+            var following = page.querySelector('.next-page');
+            if (!following) {
+                observer.disconnect();
+                next.remove();
+                return;
+            }
+            next.href = following.getAttribute('href');
+            loading = false;
+            // Observe again so a short page that leaves the link on screen loads the one after it
+            observer.unobserve(next);
+            observer.observe(next);
+        }).catch(function () {
+            loading = false;
+        });
+    }, {rootMargin: '600px'});
+    observer.observe(next);
+});
+
+// Split text into search words the same way the build does
+function searchTerms(text) {
+    return text.normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase().match(/[a-z0-9]+(?:\.[0-9]+)?/g) || [];
+}
+
+// Products having a word starting with every word of the query, found by binary search in the sorted terms
+function searchIndex(index, query) {
+    var words = searchTerms(query);
+    if (!words.length) {
+        return [];
+    }
+    var matches = null;
+    words.forEach(function (word) {
+        var low = 0, high = index.terms.length;
+        while (low < high) {
+            var middle = (low + high) >> 1;
+            if (index.terms[middle] < word) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+        var found = new Set();
+        for (var i = low; i < index.terms.length && index.terms[i].lastIndexOf(word, 0) === 0; i++) {
+            index.postings[i].forEach(function (product) {
+                found.add(product);
+            });
+        }
+        matches = matches ? new Set(Array.from(matches).filter(function (product) {
+            return found.has(product);
+        })) : found;
+    });
+    return Array.from(matches).sort(function (a, b) {
+        return a - b;
+    });
+}
+
+// Load the gzipped index the first time the search box is used
+document.addEventListener('DOMContentLoaded', function () {
+    var input = document.querySelector('.search input');
+    if (!input || !input.dataset.index || !window.fetch || !window.DecompressionStream) {
+        return;
+    }
+    var results = document.querySelector('.search-results');
+    var loaded = null;
+    function load() {
+        if (!loaded) {
+            loaded = fetch(input.dataset.index).then(function (response) {
+                return new Response(response.body.pipeThrough(new DecompressionStream('gzip'))).json();
+            });
+        }
+        return loaded;
+    }
+    input.addEventListener('focus', load);
+    input.addEventListener('input', function () {
+        var query = input.value;
+        load().then(function (index) {
+            if (input.value !== query) {
+                return;
+            }
+            results.textContent = '';
+            searchIndex(index, query).slice(0, 20).forEach(function (product) {
+                var card = index.products[product];
+                var link = document.createElement('a');
+                link.href = card[2] + '#' + card[0];
+                link.textContent = card[1] + ' (' + card[0] + ')';
+                var item = document.createElement('li');
+                item.appendChild(link);
+                results.appendChild(item);
+            });
+        });
+    });
+});
+"""
+
+# Rules needed to lay out the first screen, inlined so the page paints before the bundle arrives
+CRITICAL_SELECTORS = {'body', 'header', 'header h1', 'header h2', '.social-media-icons', '.social-media-icons img',
+                      '.product-container', '.product', '.product img', '.product h3'}
+
+# Function to read a template and split it into text and placeholders, once per process
+@functools.lru_cache(maxsize=None)
+def compile_template(name):
+    with open(os.path.join(TEMPLATE_DIR, name), encoding='utf-8') as f:
+        source = f.read()
+
+    parts = []
+    position = 0
+    for match in TEMPLATE_PATTERN.finditer(source):
+        parts.append(source[position:match.start()])
+        placeholder = match.group(1)
+        if placeholder == '$':
+            parts.append('$')
+        elif placeholder.startswith('!'):
+            parts.append((placeholder[1:], False))
+        else:
+            parts.append((placeholder, True))
+        position = match.end()
+    parts.append(source[position:])
+    return tuple(part for part in parts if part != '')
+
+
+# Function to render a template piece by piece, so pages can be written as they are rendered.
+# Raw values can be strings or iterables of strings, such as another template being streamed
+def stream(template, **context):
+    for part in compile_template(template):
+        if isinstance(part, str):
+            yield part
+            continue
+        key, escape = part
+        value = context[key]
+        if escape:
+            yield html.escape(str(value))
+        elif isinstance(value, str):
+            yield value
+        else:
+            yield from value
+
+
+# Function to render a whole template into one string
+def render(template, **context):
+    return ''.join(stream(template, **context))
+
+
+# Function to hash the card templates, so cached cards are rebuilt when a template changes
+@functools.lru_cache(maxsize=None)
+def templates_digest(names):
+    digest = hashlib.sha1()
+    for name in names:
+        digest.update(repr(compile_template(name)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Function to strip comments and whitespace from CSS
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    return '\n'.join(line.strip() for line in js.splitlines() if line.strip())
+
+
+# Function to pick the critical rules out of minified CSS, including inside @media blocks
+def critical_css(css):
+    rules = []
+    for selector, body in re.findall(r'([^{}]+)\{((?:[^{}]|\{[^{}]*\})*)\}', css):
+        if selector.startswith('@media'):
+            inner = critical_css(body)
+            if inner:
+                rules.append(f"{selector}{{{inner}}}")
+        elif selector in CRITICAL_SELECTORS:
+            rules.append(f"{selector}{{{body}}}")
+    return ''.join(rules)
+
+
+# Function to write content under a name containing its hash, so browsers can cache it forever
+def write_fingerprinted(content, stem, extension):
+    path = os.path.join(ASSET_DIR, f"{stem}.{hashlib.sha1(content).hexdigest()[:10]}.{extension}")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+    return path.replace(os.sep, '/')
+
+
+# Function to write the shared stylesheet, script and font, and return what the pages link to
+def build_assets():
+    # Self-host the font we ship instead of loading it from Google Fonts
+    font_faces = []
+    font_paths = []
+    with zipfile.ZipFile(FONT_ARCHIVE) as archive:
+        for font_file, style in FONT_FACES.items():
+            stem = os.path.splitext(font_file)[0]
+            path = write_fingerprinted(archive.read(font_file), f"fonts/{stem}", 'ttf')
+            font_paths.append(path)
+            font_faces.append(f"@font-face {{font-family: 'IM Fell DW Pica'; font-style: {style}; font-weight: 400; "
+                              f"font-display: swap; src: url('{os.path.relpath(path, ASSET_DIR).replace(os.sep, '/')}') format('truetype');}}")
+
+    css = minify_css('\n'.join(font_faces) + STYLESHEET)
+    assets = {
+        'css': write_fingerprinted(css.encode('utf-8'), 'site', 'css'),
+        'js': write_fingerprinted(minify_js(SCRIPT).encode('utf-8'), 'site', 'js'),
+        'font': font_paths[0],
+        'critical_css': critical_css(css),
+    }
+
+    # Remove bundles from earlier builds
+    current = {assets['css'], assets['js'], *font_paths}
+    for directory, _, filenames in os.walk(ASSET_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename).replace(os.sep, '/')
+            if path not in current:
+                os.remove(path)
+
+    return assets
+
+
+# Function to hash a file's contents
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to write the resized WebP and JPEG copies of one image, run in a worker process
+def make_variants(source, digest):
+    name = os.path.splitext(os.path.basename(source))[0]
+    variants = {extension: [] for extension in IMAGE_FORMATS}
+
+    with Image.open(source) as image:
+        image.load()
+        for width in IMAGE_WIDTHS:
+            # Never upscale, but always keep the smallest size
+            if width > image.width and width != IMAGE_WIDTHS[0]:
+                continue
+            resized = image.copy()
+            resized.thumbnail((width, width * 4))
+
+            for extension, (image_format, options) in IMAGE_FORMATS.items():
+                path = os.path.join(VARIANT_DIR, f"{name}-{digest[:10]}-{resized.width}.{extension}")
+                frame = resized.convert('RGB') if image_format == 'JPEG' else resized.convert('RGBA')
+                frame.save(path, image_format, **options)
+                variants[extension].append([path.replace(os.sep, '/'), resized.width])
+
+    return variants
+
+
+# Function to build the resized variants of the product images, skipping unchanged sources
+def optimize_images(sources, manifest_file=IMAGE_MANIFEST_FILE):
+    if Image is None:
+        print("Pillow is not installed, linking the original images.")
+        return {}
+
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    results = {}
+    pending = {}
+    for source in sources:
+        if not os.path.exists(source):
+            continue
+        stat = os.stat(source)
+        entry = manifest.get(source)
+
+        # Only rehash when the file looks different, and only rebuild when the contents are different
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            digest = entry['digest']
+        else:
+            digest = file_digest(source)
+
+        variant_paths = [path for paths in (entry or {}).get('variants', {}).values() for path, _ in paths]
+        if entry and entry['digest'] == digest and all(os.path.exists(path) for path in variant_paths):
+            results[source] = {**entry, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+        else:
+            pending[source] = {'digest': digest, 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+    if pending:
+        os.makedirs(VARIANT_DIR, exist_ok=True)
+        with ProcessPoolExecutor() as pool:
+            futures = {source: pool.submit(make_variants, source, entry['digest']) for source, entry in pending.items()}
+            for source, future in futures.items():
+                results[source] = {**pending[source], 'variants': future.result()}
+
+    # Drop variants left over from images that changed or went away
+    current = {os.path.basename(path) for entry in results.values() for paths in entry['variants'].values() for path, _ in paths}
+    if os.path.isdir(VARIANT_DIR):
+        for filename in os.listdir(VARIANT_DIR):
+            if filename not in current:
+                os.remove(os.path.join(VARIANT_DIR, filename))
+
+    os.makedirs(os.path.dirname(manifest_file) or '.', exist_ok=True)
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Images: {len(pending)} optimized, {len(results) - len(pending)} unchanged.")
+    return {source: entry['variants'] for source, entry in results.items()}
+
+
+# Function to stream the image of a card, as a responsive <picture> when variants exist
+def stream_image(details):
+    variants = details.get('Variants')
+    if not variants:
+        return stream('image.html', src=details['Image'], name=details['Name'])
+
+    def srcset(extension):
+        return ', '.join(f"{path} {width}w" for path, width in variants[extension])
+
+    fallback = variants['jpeg'][min(1, len(variants['jpeg']) - 1)][0]
+    return stream('picture.html', src=fallback, webp_srcset=srcset('webp'), jpeg_srcset=srcset('jpeg'),
+                  sizes=IMAGE_SIZES, name=details['Name'])
+
+
+# Function to stream one product card
+def stream_card(product_id, details, include_price=False):
+    # Include price only if requested (catalogue mode), one line per currency
+    price = ''
+    if include_price:
+        price = (part for currency, _, text in details['Prices'] if text is not None
+                 for part in stream('price.html', amount=text, currency=currency))
+
+    return stream('card.html',
+                  image=stream_image(details),
+                  name=details['Name'],
+                  product_id=product_id,
+                  price=price,
+                  sizes=(part for size in details['Sizes'] for part in stream('size.html', size=size)))
+
+
+# Function to hash everything a card shows, including when its image last changed
+def card_key(product_id, details, include_price=False):
+    image_mtime = os.stat(details['Image']).st_mtime_ns if os.path.exists(details['Image']) else None
+    fields = [
+        product_id,
+        details['Name'],
+        details['Image'],
+        image_mtime,
+        details.get('Variants'),
+        [str(size) for size in details['Sizes']],
+        details['Prices'] if include_price else None,
+        templates_digest(tuple(CARD_TEMPLATES)),
+    ]
+    return hashlib.sha1(json.dumps(fields, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+# Class to reuse rendered cards whose content hash has not changed
+class FragmentCache:
+    def __init__(self, cache_file=FRAGMENT_CACHE_FILE):
+        self.cache_file = cache_file
+        self.fragments = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, encoding='utf-8') as f:
+                self.fragments = json.load(f)
+        self.used = {}
+        self.reused = 0
+        self.rendered = 0
+
+    # Stream a card, from the cache when possible, keeping a copy of fresh ones for the next build
+    def stream_card(self, product_id, details, include_price=False):
+        key = card_key(product_id, details, include_price)
+        if key in self.fragments:
+            self.reused += 1
+            self.used[key] = self.fragments[key]
+            yield self.fragments[key]
+            return
+
+        self.rendered += 1
+        parts = []
+        for part in stream_card(product_id, details, include_price):
+            parts.append(part)
+            yield part
+        self.used[key] = ''.join(parts)
+
+    # Keep only the cards used by this build
+    def save(self):
+        os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+        with open(self.cache_file, 'w', encoding='utf-8') as f:
+            json.dump(self.used, f, ensure_ascii=False)
+
+
+# Function to collapse available rows into one row per product: first-of for the descriptive columns, sizes collected in order
+def group_products(df):
+    df = df.assign(Sizes=df['Sizes'].astype(str))
+    grouped = df.groupby('ID', sort=False)
+
+    products = grouped[[column for column in df.columns if column not in ('ID', 'Sizes', 'Count')]].first()
+    if df.empty:
+        # Nothing in stock, np.split would still return one empty chunk with no product to pair it with
+        return products.assign(**{column: pd.Series(dtype=object) for column in ['Sizes', 'Count'] if column in df.columns})
+
+    # Collect the distinct sizes of each product by sorting them by product once and splitting the array
+    unique_sizes = df.drop_duplicates(['ID', 'Sizes'])
+    codes, product_ids = pd.factorize(unique_sizes['ID'])
+    sizes = unique_sizes['Sizes'].to_numpy()[np.argsort(codes, kind='stable')]
+    bounds = np.cumsum(np.bincount(codes))[:-1]
+    products['Sizes'] = pd.Series([chunk.tolist() for chunk in np.split(sizes, bounds)], index=product_ids)
+    if 'Count' in df.columns:
+        products['Count'] = grouped['Count'].sum()
+    return products
+
+
+# Function to read the exchange rates in effect on a date (today by default), one row per currency in the order of the file
+def load_exchange_rates(rates_file=EXCHANGE_RATES_FILE, date=None):
+    if not os.path.exists(rates_file):
+        return pd.DataFrame(DEFAULT_EXCHANGE_RATES, columns=EXCHANGE_RATE_COLUMNS).set_index('Currency')
+
+    table = pd.read_csv(rates_file, dtype={'Currency': str, 'Rounding': str}).reindex(columns=EXCHANGE_RATE_COLUMNS)
+    table['Step'] = table['Step'].fillna(1)
+    table['Rounding'] = table['Rounding'].fillna('nearest').str.strip().str.lower()
+    unknown = set(table['Rounding']) - ROUNDING_MODES.keys()
+    if unknown:
+        raise ValueError(f"{rates_file}: unknown rounding {', '.join(sorted(unknown))}, use {', '.join(ROUNDING_MODES)}.")
+
+    # Rates dated later than the day asked for do not apply yet
+    dates = pd.to_datetime(table['Date'], errors='coerce', format='mixed')
+    table = table[dates.isna() | (dates <= pd.Timestamp(date or datetime.date.today()))]
+    order = table['Currency'].drop_duplicates()
+    latest = table.assign(Day=dates).sort_values('Day', kind='stable', na_position='first').groupby('Currency').last()
+    return latest.reindex(order)[EXCHANGE_RATE_COLUMNS[:1] + EXCHANGE_RATE_COLUMNS[2:]]
+
+
+# Function to convert USD prices to every currency at once, each rounded to its step. Returns one column per currency
+def price_columns(prices_usd, rates):
+    prices_usd = pd.to_numeric(prices_usd, errors='coerce').to_numpy(dtype=float)
+    columns = {}
+    for currency, rate in rates.iterrows():
+        # Rounded first to drop float noise, so 1.1 * 100 is 110 steps and not 110.00000000000001
+        steps = np.round(prices_usd * float(rate['Rate']) / float(rate['Step']), 9)
+        columns[currency] = np.round(ROUNDING_MODES[rate['Rounding']](steps) * float(rate['Step']), step_decimals(rate['Step']))
+    return pd.DataFrame(columns)
+
+
+# Function to count the decimals of a rounding step, 0 for 100, 2 for 0.05
+def step_decimals(step):
+    return 0 if float(step).is_integer() else len(f"{float(step):f}".rstrip('0').split('.')[1])
+
+
+# Function to show prices with thousands separators and as many decimals as the step has
+def format_prices(amounts, step):
+    decimals = step_decimals(step)
+    return [None if pd.isna(amount) else f"{amount:,.{decimals}f}" for amount in amounts]
+
+
+# Function to group the available rows into one entry per product with its sizes, in type order
+def build_catalogue_model(df, rates=None):
+    # Sort by Type using a categorical type for the order, keeping the file order within each type
+    df = df.assign(Type=pd.Categorical(df['Type'], categories=TYPE_ORDER, ordered=True)).sort_values('Type', kind='stable')
+
+    products = group_products(df[['ID', 'Type', 'Brand', 'Name', 'Color', 'Expected Price (USD)', 'Sizes']])
+    products['Image'] = 'images/' + products.index.astype(str) + '.png'  # Path to the image
+
+    # Every price of every product in one pass per currency, as [currency, amount, text] for the cards and indexes
+    rates = load_exchange_rates() if rates is None else rates
+    amounts = price_columns(products['Expected Price (USD)'], rates)
+    per_currency = []
+    for currency in amounts.columns:
+        step = rates.loc[currency, 'Step']
+        # Whole steps are kept as ints, so the JSON index says 148500 and not 148500.0
+        values = amounts[currency].astype('Int64' if step_decimals(step) == 0 else float).astype(object)
+        per_currency.append([[currency, None if pd.isna(value) else value, text]
+                             for value, text in zip(values, format_prices(amounts[currency], step))])
+    products['Prices'] = [list(prices) for prices in zip(*per_currency)] if per_currency else [[] for _ in range(len(products))]
+
+    # Build the dicts from whole columns, which is cheaper than to_dict('index')
+    columns = list(products.columns)
+    rows = zip(*(products[column].tolist() for column in columns))
+    return dict(zip(products.index, (dict(zip(columns, values)) for values in rows)))
+
+
+# Function to name the pages of a variant: index.html, index-2.html, and index-s.html, index-s-2.html for a type
+def page_filename(filename, section=None, page=1):
+    stem, extension = os.path.splitext(filename)
+    parts = [stem] + ([section.lower()] if section else []) + ([str(page)] if page > 1 else [])
+    return '-'.join(parts) + extension
+
+
+# Function to stream the links to the whole catalogue and to each type section
+def stream_sections(filename, types, current=None):
+    links = [(page_filename(filename), 'Todo', None)] + [(page_filename(filename, product_type), TYPE_NAMES.get(product_type, product_type), product_type) for product_type in types]
+    for href, label, section in links:
+        yield from stream('section_link.html', href=href, label=label, css_class='current' if section == current else '')
+
+
+# Function to stream a page assembled from cached and freshly rendered cards
+def stream_page(unique_products, include_price=False, cache=None, images=None, assets=None, sections='', next_page=None):
+    cache = cache or FragmentCache()
+    images = images or {}
+    assets = {'search_index': '', **(assets or build_assets())}
+
+    # Cards are rendered while the page is written, one piece at a time
+    cards = (part for product_id, details in unique_products.items()
+             for part in cache.stream_card(product_id, {**details, 'Variants': images.get(details['Image'])}, include_price))
+    next_link = stream('next_page.html', href=next_page) if next_page else ''
+    return stream('page.html', cards=cards, sections=sections, next_page=next_link, **assets)
+
+
+# Function to split every variant into its pages: the whole catalogue, then one section per product type, each in
+# pages of page_size cards linking to the next. Also returns each variant's products with the page each one is on
+def plan_pages(products, variants=CATALOGUE_VARIANTS):
+    pages = []
+    indexes = []
+    for variant in variants:
+        filename = variant['filename']
+        include_price = variant.get('include_price', False)
+        page_size = variant.get('page_size', PAGE_SIZE)
+        types = variant.get('types')
+        selected = {product_id: details for product_id, details in products.items() if not types or details['Type'] in types}
+        present = [product_type for product_type in TYPE_ORDER if any(details['Type'] == product_type for details in selected.values())]
+
+        for section in [None] + present:
+            product_ids = [product_id for product_id, details in selected.items() if section is None or details['Type'] == section]
+            page_count = max(1, -(-len(product_ids) // page_size))
+            filenames = [page_filename(filename, section, page) for page in range(1, page_count + 1)]
+            for page, page_file in enumerate(filenames):
+                pages.append({
+                    'filename': page_file,
+                    'variant': filename,
+                    'products': {product_id: selected[product_id] for product_id in product_ids[page * page_size:(page + 1) * page_size]},
+                    'include_price': include_price,
+                    'types': present,
+                    'section': section,
+                    'next_page': filenames[page + 1] if page + 1 < page_count else None,
+                })
+            if section is None:
+                positions = {product_id: filenames[position // page_size] for position, product_id in enumerate(product_ids)}
+
+        indexes.append({'filename': filename, 'products': selected, 'pages': positions, 'include_price': include_price})
+    return pages, indexes
+
+
+# Function to stream one planned page
+def stream_planned_page(page, cache, images, assets):
+    return stream_page(page['products'], page['include_price'], cache, images, {**assets, 'search_index': search_index_filename(page['variant'])},
+                       stream_sections(page['variant'], page['types'], page['section']), page['next_page'])
+
+
+# Function to write one planned page, assembled from cached and freshly rendered cards
+def write_page(page, cache, images, assets):
+    reused, rendered = cache.reused, cache.rendered
+    with open(page['filename'], 'w', encoding='utf-8') as f:
+        f.writelines(stream_planned_page(page, cache, images, assets))
+
+    print(f"HTML file {page['filename']} generated successfully ({cache.rendered - rendered} cards rendered, {cache.reused - reused} reused).")
+
+
+# Function to hash every card of a planned page
+def page_card_keys(page, images):
+    return [card_key(product_id, {**details, 'Variants': images.get(details['Image'])}, page['include_price'])
+            for product_id, details in page['products'].items()]
+
+
+# Function to hash everything a planned page shows, so a page is only rendered again when one of its cards or links changed
+def page_key(page, card_keys):
+    fields = [
+        page['filename'],
+        page['variant'],
+        page['section'],
+        page['types'],
+        page['next_page'],
+        card_keys,
+        templates_digest(('page.html', 'section_link.html', 'next_page.html')),
+    ]
+    return hashlib.sha1(json.dumps(fields).encode('utf-8')).hexdigest()
+
+
+# Function to build a compact JSON index of every card of a variant, with the page each one is on
+def product_index(unique_products, pages, include_price, images):
+    fields = ['id', 'type', 'brand', 'name', 'color', 'sizes', 'image', 'page'] + (['prices'] if include_price else [])
+    cards = []
+    for product_id, details in unique_products.items():
+        variants = images.get(details['Image'])
+        card = [product_id, details['Type'], details['Brand'], details['Name'], details['Color'], [str(size) for size in details['Sizes']],
+                variants['jpeg'][0][0] if variants else details['Image'], pages[product_id]]
+        if include_price:
+            card.append({currency: amount for currency, amount, _ in details['Prices']})
+        cards.append(card)
+
+    return json.dumps({'fields': fields, 'cards': cards}, ensure_ascii=False, separators=(',', ':'))
+
+
+# Function to name the JSON index of a variant, e.g. catalogue.json
+def product_index_filename(filename):
+    return os.path.splitext(filename)[0] + '.json'
+
+
+# Function to write the JSON index of a variant
+def write_product_index(filename, unique_products, pages, include_price, images):
+    index_file = product_index_filename(filename)
+    with open(index_file, 'w', encoding='utf-8') as f:
+        f.write(product_index(unique_products, pages, include_price, images))
+    return index_file
+
+
+# Function to split text into lowercase search words without accents
+def search_terms(text):
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii').lower()
+    return SEARCH_TERM_PATTERN.findall(text)
+
+
+# Function to name the search index of a variant, e.g. catalogue-search.json.gz
+def search_index_filename(filename):
+    return os.path.splitext(filename)[0] + '-search.json.gz'
+
+
+# Function to build a gzipped inverted index over name, brand, color, type and sizes for searching in the browser.
+# Terms are sorted so a prefix is found by binary search, and each term lists the products that contain it
+def search_index(unique_products, pages):
+    products = []
+    postings = {}
+    for position, (product_id, details) in enumerate(unique_products.items()):
+        products.append([product_id, details['Name'], pages[product_id]])
+        text = ' '.join(str(details[column]) for column in ['Name', 'Brand', 'Color', 'Type'])
+        text += ' ' + TYPE_NAMES.get(details['Type'], '') + ' ' + product_id
+        terms = set(search_terms(text)) | {term for size in details['Sizes'] for term in search_terms(size)}
+        for term in terms:
+            postings.setdefault(term, []).append(position)
+
+    terms = sorted(postings)
+    index = {'products': products, 'terms': terms, 'postings': [postings[term] for term in terms]}
+    content = json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    # A fixed timestamp keeps the file identical when the catalogue did not change
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+# Function to write the search index of a variant
+def write_search_index(filename, unique_products, pages):
+    index_file = search_index_filename(filename)
+    with open(index_file, 'wb') as f:
+        f.write(search_index(unique_products, pages))
+    return index_file
+
+
+# Function to remove the pages and indexes a variant's previous build wrote and this one did not. written maps each variant
+# built to its files, variants left out of this build keep theirs
+def prune_pages(written, manifest_file=PAGE_MANIFEST_FILE):
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    kept = {filename for variant, filenames in manifest.items() if variant not in written for filename in filenames}
+    for variant, filenames in written.items():
+        for filename in manifest.get(variant, []):
+            if filename not in filenames and filename not in kept and os.path.exists(filename):
+                os.remove(filename)
+        manifest[variant] = sorted(filenames)
+
+    os.makedirs(os.path.dirname(manifest_file) or '.', exist_ok=True)
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+# Function to list the source images of a product model
+def image_sources(products):
+    return sorted({details['Image'] for details in products.values()})
+
+
+# Function to write every variant of the catalogue from one product model, with already optimized images if given
+def render_variants(products, variants=CATALOGUE_VARIANTS, images=None):
+    # All pages share one cache of rendered cards
+    cache = FragmentCache()
+
+    # Resize the product images in parallel, skipping the ones that did not change
+    if images is None:
+        images = optimize_images(image_sources(products))
+
+    # One fingerprinted stylesheet, script and font for every page
+    assets = build_assets()
+
+    pages, indexes = plan_pages(products, variants)
+    written = {variant['filename']: set() for variant in variants}
+    for page in pages:
+        write_page(page, cache, images, assets)
+        written[page['variant']].add(page['filename'])
+
+    for index in indexes:
+        written[index['filename']].add(write_product_index(index['filename'], index['products'], index['pages'], index['include_price'], images))
+        written[index['filename']].add(write_search_index(index['filename'], index['products'], index['pages']))
+
+    prune_pages(written)
+    cache.save()
+    print(f"Catalogue built: {cache.rendered} cards rendered, {cache.reused} reused.")
+    return cache
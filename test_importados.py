@@ -0,0 +1,227 @@
+import multiprocessing
+import os
+
+import pandas as pd
+import pytest
+
+import importados
+import sales_rollup
+import trip_summary
+
+
+# An empty inventory in its own folder, the working directory for the test
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    importados.create_missing_files()
+    return tmp_path
+
+
+# Raised in place of a crash, halfway through saving
+class Crash(Exception):
+    pass
+
+
+def add(store, sizes='9, 10', name='Air Max'):
+    return importados.create_product(store, 'S', 'J', 'Nike', name, 'Black', 50.0, 100.0, 1, sizes)
+
+
+def stock(store):
+    return sorted(zip(store.available['ID'], store.available['Sizes'], store.available['Count'].astype(float)))
+
+
+# The kept trip summary and sales rollup have to match a full recount of the files
+def assert_totals(store):
+    recount = trip_summary.compute_trip_summary(store.products, store.available, store.sold)
+    assert trip_summary.summary_differences(store.trip_summary(), recount).empty
+
+    rollup = sales_rollup.SalesRollup()
+    rollup.add(store.sold)
+    by = list(sales_rollup.ROLLUP_KEYS)
+    assert store.sales_rollup().summary(by=by).round(6).equals(rollup.summary(by=by).round(6))
+
+
+def add_products(directory, count):
+    os.chdir(directory)
+    store = importados.InventoryStore()
+    for _ in range(count):
+        add(store)
+
+
+def test_recovers_a_save_interrupted_between_renames(inventory, monkeypatch):
+    store = importados.InventoryStore()
+    add(store)
+
+    # Adding a product renames products.csv and available.csv into place, crash after the first one
+    replace = os.replace
+    renamed = []
+
+    def crash_on_second_rename(source, target):
+        if renamed:
+            raise Crash()
+        renamed.append(target)
+        replace(source, target)
+
+    with monkeypatch.context() as patched, pytest.raises(Crash):
+        patched.setattr(importados.os, 'replace', crash_on_second_rename)
+        add(store, name='Cortez')
+    assert os.path.exists(importados.TRANSACTION_FILE)
+
+    # The log was written before the first rename, so the next session finishes the save
+    store = importados.InventoryStore()
+    assert list(store.products['Name']) == ['Air Max', 'Cortez']
+    assert set(store.available['ID']) == set(store.products['ID'])
+    assert not os.path.exists(importados.TRANSACTION_FILE)
+    assert not list(inventory.glob('*.tmp'))
+    assert_totals(store)
+
+
+def test_drops_a_save_interrupted_before_its_log(inventory, monkeypatch):
+    store = importados.InventoryStore()
+    add(store)
+
+    write_synced = importados.write_synced
+
+    def crash_writing_the_log(path, write):
+        if path.endswith(importados.TRANSACTION_FILE):
+            raise Crash()
+        write_synced(path, write)
+
+    with monkeypatch.context() as patched, pytest.raises(Crash):
+        patched.setattr(importados, 'write_synced', crash_writing_the_log)
+        add(store, name='Cortez')
+    assert list(inventory.glob('*.tmp'))
+
+    # Nothing was renamed yet, so the staged files are thrown away and the files are as before the save
+    store = importados.InventoryStore()
+    assert list(store.products['Name']) == ['Air Max']
+    assert not list(inventory.glob('*.tmp'))
+    assert_totals(store)
+
+
+def test_drops_a_log_cut_short(inventory):
+    store = importados.InventoryStore()
+    add(store)
+    with open(importados.TRANSACTION_FILE, 'w') as f:
+        f.write('{"renames": [["products.csv.tmp", "prod')
+    with open(importados.PRODUCTS_FILE + '.tmp', 'w') as f:
+        f.write('ID\n')
+
+    store = importados.InventoryStore()
+    assert list(store.products['Name']) == ['Air Max']
+    assert not os.path.exists(importados.TRANSACTION_FILE)
+    assert not os.path.exists(importados.PRODUCTS_FILE + '.tmp')
+
+
+@pytest.mark.parametrize('backend', ['csv', 'sqlite'])
+def test_two_stores_add_products_to_the_same_folder(inventory, backend):
+    first = importados.open_store(backend)
+    second = importados.open_store(backend)
+    first.products, second.products
+
+    ids = [add(first), add(second), add(first), add(second)]
+    assert len(set(ids)) == 4
+
+    store = importados.open_store(backend)
+    assert sorted(store.products['ID']) == sorted(ids)
+    assert sorted(set(store.available['ID'])) == sorted(ids)
+    assert_totals(store)
+
+
+def test_operation_runs_again_when_another_store_saved_first(inventory):
+    first = importados.InventoryStore()
+    second = importados.InventoryStore()
+    attempts = []
+
+    def add_while_first_saves():
+        attempts.append(len(attempts) + 1)
+        if len(attempts) == 1:
+            add(first, name='Cortez')  # Saved by the other session after this one started
+        return add(second)
+
+    product_id = second.apply(add_while_first_saves)
+    assert len(attempts) == 2
+    assert product_id == 'SJ02'
+    assert list(importados.InventoryStore().products['Name']) == ['Cortez', 'Air Max']
+
+
+@pytest.mark.parametrize('backend', ['csv', 'sqlite'])
+def test_two_stores_sell_the_last_unit_once(inventory, backend):
+    first = importados.open_store(backend)
+    product_id = add(first, sizes='9')
+    second = importados.open_store(backend)
+    assert not second.find_available(product_id, '9').empty
+
+    assert importados.sell_item(first, product_id, '9', '2024-05-01', 120.0)
+    assert not importados.sell_item(second, product_id, '9', '2024-05-01', 120.0)
+
+    store = importados.open_store(backend)
+    assert len(store.sold) == 1
+    assert store.find_available(product_id).empty
+    assert_totals(store)
+
+
+def test_processes_adding_products_at_once_get_distinct_ids(inventory):
+    processes = [multiprocessing.Process(target=add_products, args=(str(inventory), 5)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    store = importados.InventoryStore()
+    assert len(store.products) == 20
+    assert store.products['ID'].is_unique
+    assert len(store.available) == 40
+    assert_totals(store)
+
+
+def test_sizes_out_of_stock_are_not_sold(inventory):
+    rows = pd.DataFrame([{'ID': 'SJ01', 'Type': 'S', 'Gender': 'J', 'Brand': 'Nike', 'Name': 'Air Max', 'Color': 'Black',
+                          'Cost (USD)': 50.0, 'Expected Price (USD)': 100.0, 'Trip #': 1, 'Sizes': '9', 'Count': 0}])
+    rows.to_csv(importados.AVAILABLE_FILE, index=False)
+    store = importados.InventoryStore()
+    assert store.available.empty
+    assert not importados.sell_item(store, 'SJ01', '9', '2024-05-01', 120.0)
+
+
+def test_compaction_keeps_the_inventory(inventory):
+    store = importados.InventoryStore()
+    first, second = add(store, sizes='9, 9, 10'), add(store, sizes='8')
+    importados.sell_item(store, first, '9', '2024-05-01', 120.0)
+    importados.sell_item(store, second, '8', '2024-05-02', 90.0)
+    available = stock(store)
+    assert os.path.exists(importados.SALES_JOURNAL_FILE)
+
+    store.compact()
+    assert not os.path.exists(importados.SALES_JOURNAL_FILE)
+
+    store = importados.InventoryStore()
+    assert stock(store) == available
+    assert len(store.sold) == 2
+    assert_totals(store)
+
+
+@pytest.mark.parametrize('backend', ['csv', 'sqlite'])
+def test_kept_totals_follow_every_change(inventory, backend):
+    store = importados.open_store(backend)
+    product_id = add(store, sizes='9, 9, 10')
+    other_id = add(store, sizes='8')
+    importados.update_product(store, product_id, {'Expected Price (USD)': '110', 'Trip #': '2'})
+    importados.sell_item(store, product_id, '9', '2024-05-01', 120.0)
+    importados.sell_item(store, other_id, '8', '2024-05-01', 80.0)
+    importados.update_product(store, product_id, {'Sizes': '9, 11'})
+    importados.update_sale(store, product_id, {'Final Price': '125', 'Selling Date': '2024-05-03'})
+    importados.remove_product(store, other_id)
+    assert_totals(store)
+
+    # A new session starts from the saved totals and replays the journal
+    assert_totals(importados.open_store(backend))
+
+
+@pytest.mark.parametrize('backend', ['csv', 'sqlite'])
+def test_ids_are_numbered_past_99(inventory, backend):
+    pd.DataFrame([{'ID': 'SJ99', 'Type': 'S', 'Gender': 'J', 'Brand': 'Nike', 'Name': 'Air Max', 'Color': 'Black', 'Cost (USD)': 50.0,
+                   'Expected Price (USD)': 100.0, 'Trip #': 1, 'Sizes': '9', 'Count': 1}]).to_csv(importados.PRODUCTS_FILE, index=False)
+    store = importados.open_store(backend)
+    assert [add(store), add(store), add(store, name='Cortez')] == ['SJ100', 'SJ101', 'SJ102']
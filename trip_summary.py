@@ -0,0 +1,113 @@
+import pandas as pd
+
+from sales_rollup import trip_keys
+
+# Totals kept for each trip
+SUMMARY_COLUMNS = ['Units', 'Gross Cost', 'Expected Revenue', 'Remaining Units', 'Sold Units']
+
+
+# Function to turn products, available rows and sales into per-trip amounts, ready to be added to the summary
+def trip_amounts(products=None, available=None, sales=None):
+    parts = []
+    if products is not None and not products.empty:
+        count = pd.to_numeric(products['Count'], errors='coerce').fillna(0)
+        parts.append(pd.DataFrame({
+            'Trip #': trip_keys(products['Trip #']),
+            'Units': count,
+            'Gross Cost': pd.to_numeric(products['Cost (USD)'], errors='coerce').fillna(0) * count,
+            'Expected Revenue': pd.to_numeric(products['Expected Price (USD)'], errors='coerce').fillna(0) * count,
+        }))
+    if available is not None and not available.empty:
+        parts.append(pd.DataFrame({
+            'Trip #': trip_keys(available['Trip #']),
+            'Remaining Units': pd.to_numeric(available['Count'], errors='coerce').fillna(0),
+        }))
+    if sales is not None and not sales.empty:
+        parts.append(pd.DataFrame({'Trip #': trip_keys(sales['Trip #']), 'Sold Units': 1}))
+
+    if not parts:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    return pd.concat(parts).reindex(columns=['Trip #'] + SUMMARY_COLUMNS).fillna(0).groupby('Trip #')[SUMMARY_COLUMNS].sum()
+
+
+# Class to keep the expected profit of every trip, changed by the amounts of what was added, edited, removed or sold
+class TripSummary:
+    def __init__(self, cells=()):
+        self.cells = {}  # Trip # -> amounts in SUMMARY_COLUMNS order
+        for trip, *amounts in cells:
+            self.cells[trip] = list(amounts)
+
+    # Add products and their available rows, or sales, which move units from remaining to sold
+    def add(self, products=None, available=None, sales=None, sign=1):
+        if sales is not None:
+            amounts = trip_amounts(sales=sales)
+            # Every sold unit leaves the remaining units
+            amounts['Remaining Units'] = -amounts['Sold Units']
+            self.apply(amounts, sign)
+        self.apply(trip_amounts(products, available), sign)
+
+    def remove(self, products=None, available=None, sales=None):
+        self.add(products, available, sales, sign=-1)
+
+    def apply(self, amounts, sign):
+        for trip, row in zip(amounts.index, amounts.itertuples(index=False, name=None)):
+            cell = self.cells.setdefault(trip, [0.0] * len(SUMMARY_COLUMNS))
+            for position, amount in enumerate(row):
+                cell[position] += sign * float(amount)
+            if not any(round(amount, 6) for amount in cell):
+                del self.cells[trip]
+
+    # Cells as rows for saving
+    def rows(self):
+        return [[trip, *cell] for trip, cell in sorted(self.cells.items())]
+
+    def frame(self):
+        summary = pd.DataFrame(self.rows(), columns=['Trip #'] + SUMMARY_COLUMNS)
+        summary['Expected Profit'] = summary['Expected Revenue'] - summary['Gross Cost']
+        summary[['Gross Cost', 'Expected Revenue', 'Expected Profit']] = summary[['Gross Cost', 'Expected Revenue', 'Expected Profit']].round(2)
+        for column in ['Units', 'Remaining Units', 'Sold Units']:
+            summary[column] = summary[column].round().astype(int)
+        return summary[['Trip #', 'Units', 'Gross Cost', 'Expected Revenue', 'Expected Profit', 'Remaining Units', 'Sold Units']]
+
+
+# Function to total the whole inventory from scratch, used to build the summary and to audit it
+def compute_trip_summary(products, available, sold):
+    summary = TripSummary()
+    summary.apply(trip_amounts(products, available, sold), 1)
+    return summary
+
+
+# Function to list the trips where two summaries disagree
+def summary_differences(maintained, recomputed):
+    columns = ['Trip #'] + SUMMARY_COLUMNS
+    both = pd.DataFrame(maintained.rows(), columns=columns).merge(
+        pd.DataFrame(recomputed.rows(), columns=columns), on='Trip #', how='outer', suffixes=(' (kept)', ' (recomputed)')).fillna(0)
+    differs = pd.Series(False, index=both.index)
+    for column in SUMMARY_COLUMNS:
+        differs |= (both[f"{column} (kept)"] - both[f"{column} (recomputed)"]).abs() > 0.005
+    return both[differs]
+
+
+# Class to keep the trip summary as a table of the SQLite database, updated in the same transactions as the inventory
+class SqliteTripSummary(TripSummary):
+    def __init__(self, conn):
+        self.conn = conn
+        columns = ', '.join(f'"{column}" REAL' for column in SUMMARY_COLUMNS)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS trip_summary ("Trip #" TEXT PRIMARY KEY, {columns})')
+
+    def apply(self, amounts, sign):
+        rows = [(trip, *(sign * float(amount) for amount in row)) for trip, row in zip(amounts.index, amounts.itertuples(index=False, name=None))]
+        columns = ', '.join(f'"{column}"' for column in SUMMARY_COLUMNS)
+        updates = ', '.join(f'"{column}" = "{column}" + excluded."{column}"' for column in SUMMARY_COLUMNS)
+        self.conn.executemany(f'INSERT INTO trip_summary ("Trip #", {columns}) VALUES ({", ".join("?" * (len(SUMMARY_COLUMNS) + 1))}) '
+                              f'ON CONFLICT ("Trip #") DO UPDATE SET {updates}', rows)
+        # Trips whose amounts all came back to zero
+        self.conn.execute('DELETE FROM trip_summary WHERE ' + ' AND '.join(f'ABS("{column}") < 0.000001' for column in SUMMARY_COLUMNS))
+
+    # Throw the rows away and keep the given ones instead
+    def replace(self, rows):
+        self.conn.execute('DELETE FROM trip_summary')
+        self.conn.executemany(f'INSERT INTO trip_summary VALUES ({", ".join("?" * (len(SUMMARY_COLUMNS) + 1))})', rows)
+
+    def rows(self):
+        return [list(row) for row in self.conn.execute('SELECT * FROM trip_summary ORDER BY "Trip #"')]